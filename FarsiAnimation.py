@@ -0,0 +1,245 @@
+import bpy
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from bpy.types import Operator, Context
+from bpy.props import EnumProperty, IntProperty
+from bpy.app.handlers import persistent
+from . import FarsiText as Fa
+
+
+# Animated texts: the shaped body of every state (keyframed text or typewriter prefix) is shaped
+# once when it's baked, and kept on the curve in its "farsi_animation" property:
+# frames (where each state starts), bodies (the rest of every state's body, one after the other),
+# offsets (where each of them starts in bodies, and the end), line_counts, lines and line_offsets.
+# The body of a state is its line_counts first lines of lines (each with its newline,
+# line_offsets is where each of them starts, and the end), then its rest: the prefixes of a
+# typewriter share their full lines instead of keeping a copy of them each.
+# Changing frames only looks the body up, and the tables go with the .blend file (render nodes).
+property_name = "farsi_animation"
+
+
+class AnimationTable:
+
+    def __init__(self, frames, bodies, offsets, line_counts=None, lines='', line_offsets=(0,)):
+        self.frames = array('i', frames)
+        self.bodies = bodies
+        self.offsets = array('i', offsets)
+        self.line_counts = array('i', line_counts if line_counts is not None else [0] * len(self.frames))
+        self.lines = lines
+        self.line_offsets = array('i', line_offsets)
+
+    def __len__(self):
+        return len(self.frames)
+
+    # (frame, line count, rest) of a state
+    def get_state(self, index):
+        return self.frames[index], self.line_counts[index], self.bodies[self.offsets[index] : self.offsets[index + 1]]
+
+    def get_body(self, index):
+        return self.lines[:self.line_offsets[self.line_counts[index]]] + self.bodies[self.offsets[index] : self.offsets[index + 1]]
+
+    # The body shown at frame (the first state's before it starts)
+    def body_at(self, frame):
+        return self.get_body(max(bisect_right(self.frames, frame) - 1, 0))
+
+    def get_states(self):
+        return [self.get_state(index) for index in range(len(self))]
+
+    # The lines the states share
+    def get_lines(self):
+        return self.lines.split('\n')[:-1]
+
+
+# Tables read from the curves, by session_uid of the curve
+tables = {}
+
+def get_table(curve) -> AnimationTable:
+    table = tables.get(curve.session_uid)
+    if table is None:
+        data = curve[property_name]
+        table = AnimationTable(data["frames"], data["bodies"], data["offsets"],
+                               data.get("line_counts"), data.get("lines", ''), data.get("line_offsets", (0,)))
+        tables[curve.session_uid] = table
+    return table
+
+
+# Keep (frame, line count, rest) states on a curve, sorted by frame: the body of a state is
+# its line count first lines of lines, then rest (see AnimationTable).
+# A state that shows the same body as the one before it is left out.
+def write_states(curve, states, lines=()):
+    frames = []
+    line_counts = []
+    bodies = []
+    offsets = [0]
+    for frame, line_count, body in sorted(states, key=lambda state: state[0]):
+        if frames and frame == frames[-1]:
+            # The last one at the same frame wins
+            frames.pop()
+            line_counts.pop()
+            bodies.pop()
+            offsets.pop()
+        if bodies and body == bodies[-1] and line_count == line_counts[-1]:
+            continue
+        frames.append(frame)
+        line_counts.append(line_count)
+        bodies.append(body)
+        offsets.append(offsets[-1] + len(body))
+
+    if not frames:
+        clear_states(curve)
+        return
+
+    lines = lines[:max(line_counts)]
+    curve[property_name] = {
+        "frames": frames, "bodies": ''.join(bodies), "offsets": offsets, "line_counts": line_counts,
+        "lines": ''.join(line + '\n' for line in lines),
+        "line_offsets": list(accumulate((len(line) + 1 for line in lines), initial=0)),
+    }
+    tables.pop(curve.session_uid, None)
+
+
+# Bake states of (frame, text) (texts in logical order) on a curve, e.g. a counter:
+# bake_states(curve, [(frame, str(frame)) for frame in range(1, 251)])
+def bake_states(curve, states):
+    states = list(states)
+    shaped = list(Fa.shape_texts(text for frame, text in states))
+    write_states(curve, [(frame, 0, body) for (frame, text), body in zip(states, shaped)])
+
+    if states:
+        # The last state is the text of the curve (see get_logical_text), the last one at its frame wins
+        last = max(range(len(states)), key=lambda index: (states[index][0], index))
+        save_text(curve, states[last][1], shaped[last])
+
+
+# Bake a typewriter reveal of text (logical order), one more char every frames_per_char frames.
+# Every full line is shaped once and shared by the prefixes that show it, only the last line of
+# each prefix is shaped for it. Without Fa.line_cache: these lines are only shaped once, they
+# would push the lines of the edited texts out of it.
+def bake_typewriter(curve, text, frame_start, frames_per_char=1):
+    lines = text.split('\n')
+    full_lines = [Fa.link_single_line(line, number == 0) for number, line in enumerate(lines[:-1])]
+
+    states = []
+    start = 0   # Where the line starts in text
+    for number, line in enumerate(lines):
+        for length in range(len(line) + 1):
+            frame = frame_start + (start + length) * frames_per_char
+            states.append((frame, number, Fa.link_single_line(line[:length], number == 0)))
+        start += len(line) + 1
+
+    write_states(curve, states, full_lines)
+    save_text(curve, text, '\n'.join(full_lines + [states[-1][2]]))
+
+
+# Add a state (frame, text in logical order) to the baked ones of a curve
+def add_state(curve, frame, text):
+    table = get_table(curve) if property_name in curve else None
+    states = table.get_states() if table is not None else []
+    body = Fa.shape_text_once(text)
+    if not states or frame >= states[-1][0]:
+        save_text(curve, text, body)
+    states.append((frame, 0, body))
+    write_states(curve, states, table.get_lines() if table is not None else ())
+
+
+# Keep the logical text of the last state on the curve, so it isn't unlinked from its body
+def save_text(curve, text, body):
+    curve[Fa.state_property] = Fa.make_saved_state(text, body)
+
+
+def clear_states(curve):
+    if property_name in curve:
+        del curve[property_name]
+    tables.pop(curve.session_uid, None)
+
+
+# The text of a curve in logical order (the last state of an animated one)
+def get_logical_text(curve):
+    body = curve.body
+    if property_name in curve:
+        table = get_table(curve)
+        body = table.get_body(len(table) - 1)
+    return Fa.get_logical_text(body, curve.get(Fa.state_property))
+
+
+@persistent
+def frame_handler(scene, depsgraph=None):
+    frame = scene.frame_current
+    for curve in bpy.data.curves:
+        if property_name not in curve or curve.is_editmode:
+            continue
+        body = get_table(curve).body_at(frame)
+        if curve.body != body:
+            curve.body = body
+
+# Undo and loading files bring other tables
+@persistent
+def reset_handler(dummy):
+    tables.clear()
+
+
+class __OT_FarsiTextAnimate(Operator):
+    """Animate Farsi/Arabic text: bake its states once, so changing frames only looks them up"""
+
+    bl_idname = "object.farsi_text_animate"
+    bl_label = "Animate Farsi Text"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    action: EnumProperty(
+        name="Action",
+        items=[
+            ('TYPEWRITER', "Typewriter", "Reveal the text one character at a time"),
+            ('ADD_STATE', "Add State", "Show the current text from the current frame on"),
+            ('CLEAR', "Clear", "Remove the animation"),
+        ],
+        default='TYPEWRITER',
+    )
+    frame_start: IntProperty(name="Start", description="First frame of the typewriter", default=1)
+    frames_per_char: IntProperty(name="Frames per Character", default=2, min=1)
+
+    @classmethod
+    def poll(cls, context: Context):
+        obj = context.object
+        return obj is not None and obj.type == 'FONT' and obj.mode != 'EDIT'
+
+    def invoke(self, context: Context, event):
+        self.frame_start = context.scene.frame_current
+        return self.execute(context)
+
+    def execute(self, context: Context):
+        curve = context.object.data
+
+        if self.action == 'TYPEWRITER':
+            bake_typewriter(curve, get_logical_text(curve), self.frame_start, self.frames_per_char)
+        elif self.action == 'ADD_STATE':
+            # The text as it was edited at this frame
+            add_state(curve, context.scene.frame_current, Fa.get_logical_text(curve.body, curve.get(Fa.state_property)))
+        else:
+            clear_states(curve)
+            return {'FINISHED'}
+
+        frame_handler(context.scene)
+        return {'FINISHED'}
+
+
+reset_handlers = (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post)
+
+def register():
+    bpy.utils.register_class(__OT_FarsiTextAnimate)
+
+    if frame_handler not in bpy.app.handlers.frame_change_pre:
+        bpy.app.handlers.frame_change_pre.append(frame_handler)
+    for handlers in reset_handlers:
+        if reset_handler not in handlers:
+            handlers.append(reset_handler)
+
+def unregister():
+    if frame_handler in bpy.app.handlers.frame_change_pre:
+        bpy.app.handlers.frame_change_pre.remove(frame_handler)
+    for handlers in reset_handlers:
+        if reset_handler in handlers:
+            handlers.remove(reset_handler)
+
+    bpy.utils.unregister_class(__OT_FarsiTextAnimate)
+    tables.clear()
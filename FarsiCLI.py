@@ -0,0 +1,100 @@
+# Reshape the Farsi/Arabic text of .blend files from the command line.
+#
+# In Blender, reshape files one after the other:
+#   blender -b --factory-startup --python FarsiCLI.py -- --write file1.blend file2.blend ...
+#
+# With Python, reshape them in parallel (files are split between -j Blender processes):
+#   python FarsiCLI.py -j 8 --blender /path/to/blender --write file1.blend file2.blend ...
+#
+# Texts are shaped from their saved logical text, or line by line from their body (see
+# FarsiShaper.reshape_curves). Without --write nothing is saved: the files are only checked.
+# Every file is reported as a JSON line: {"file", "texts", "changed", "seconds"} (or "error").
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Reshape the Farsi/Arabic text of .blend files")
+    parser.add_argument("files", nargs="+", help=".blend files")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Blender processes (driver only)")
+    parser.add_argument("--blender", default="blender", help="Blender executable (driver only)")
+    parser.add_argument("--write", action="store_true", help="Save the files (else only report what would change)")
+    return parser.parse_args(argv)
+
+
+# In Blender: reshape every text datablock of the files
+def reshape_files(files, write=False):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import FarsiShaper as Fa
+
+    for path in files:
+        start = time.perf_counter()
+        try:
+            bpy.ops.wm.open_mainfile(filepath=path)
+            curves = [curve for curve in bpy.data.curves if isinstance(curve, bpy.types.TextCurve)]
+
+            changed = Fa.reshape_curves(curves)
+
+            if changed and write:
+                bpy.ops.wm.save_mainfile()
+            report = {"file": path, "texts": len(curves), "changed": changed}
+        except Exception as error:
+            report = {"file": path, "error": str(error)}
+
+        report["seconds"] = round(time.perf_counter() - start, 3)
+        print(json.dumps(report, ensure_ascii=False), flush=True)
+
+
+# Without Blender: split the files between Blender processes and collect their reports
+def run_driver(args):
+    jobs = max(1, min(args.jobs, len(args.files)))
+    shards = [args.files[i::jobs] for i in range(jobs)]
+
+    def run_shard(files):
+        command = [args.blender, "-b", "--factory-startup", "--python", os.path.abspath(__file__), "--"]
+        if args.write:
+            command.append("--write")
+        process = subprocess.run(command + files, capture_output=True, text=True, encoding="utf-8")
+
+        reports = []
+        for line in process.stdout.splitlines():
+            if line.startswith('{"file"'):
+                print(line, flush=True)
+                reports.append(json.loads(line))
+        if process.returncode != 0:
+            print(process.stderr, file=sys.stderr)
+        return reports
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(jobs) as executor:
+        reports = [report for shard in executor.map(run_shard, shards) for report in shard]
+
+    failed = sum(1 for report in reports if "error" in report)
+    changed = sum(report.get("changed", 0) for report in reports)
+    print(f"{len(reports)} files ({failed} failed), {changed} texts {'reshaped' if args.write else 'to reshape'}, {time.perf_counter() - start:.2f}s with {jobs} processes", file=sys.stderr)
+    return 1 if failed or len(reports) < len(args.files) else 0
+
+
+def main():
+    if bpy is not None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+        args = parse_args(argv)
+        reshape_files(args.files, args.write)
+        return 0
+
+    return run_driver(parse_args(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
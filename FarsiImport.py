@@ -0,0 +1,162 @@
+import bpy
+import os
+from collections import deque
+from bpy.types import Operator, Context
+from bpy.props import StringProperty, EnumProperty, IntProperty, FloatProperty
+from bpy_extras.io_utils import ImportHelper
+from . import FarsiText as Fa
+
+
+# Read the cues of a .srt/.txt file one at a time: (start, end, text), times in seconds.
+# Cues are separated by empty lines, .txt cues (paragraphs) have no times (None).
+# Only the cue being read is kept, so big files don't take more memory.
+def read_cues(file, timed=True):
+    lines = []
+    for line in file:
+        line = line.rstrip('\r\n')
+        if line.strip():
+            lines.append(line)
+        elif lines:
+            cue = parse_cue(lines, timed)
+            if cue is not None:
+                yield cue
+            lines = []
+
+    if lines:
+        cue = parse_cue(lines, timed)
+        if cue is not None:
+            yield cue
+
+
+# A block of .srt lines: an optional number, the times ("00:00:01,000 --> 00:00:02,500") and the text
+def parse_cue(lines, timed):
+    if not timed:
+        return None, None, '\n'.join(lines)
+
+    if '-->' not in lines[0] and len(lines) > 1:
+        lines = lines[1:]
+    if '-->' not in lines[0]:
+        return None
+
+    start, end = lines[0].split('-->')
+    text = '\n'.join(lines[1:])
+    return parse_time(start), parse_time(end.split()[0]), text
+
+
+# "hh:mm:ss,mmm" in seconds
+def parse_time(time):
+    hours, minutes, seconds = time.strip().replace(',', '.').split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+class __OT_FarsiTextImport(Operator, ImportHelper):
+    """Import Farsi/Arabic subtitles (.srt) or paragraphs (.txt) as shaped texts"""
+
+    bl_idname = "import_scene.farsi_text"
+    bl_label = "Import Farsi Text"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    filter_glob: StringProperty(default="*.srt;*.txt", options={'HIDDEN'})
+
+    target: EnumProperty(
+        name="Import As",
+        items=[
+            ('OBJECTS', "Text Objects", "A text object for each cue"),
+            ('STRIPS', "Text Strips", "A text strip in the sequencer for each cue, at its time"),
+        ],
+        default='OBJECTS',
+    )
+    spacing: FloatProperty(name="Spacing", description="Distance between the text objects", default=2.0)
+    channel: IntProperty(name="Channel", description="Sequencer channel of the strips", default=2, min=1, max=128)
+    duration: IntProperty(name="Duration", description="Frames of each cue without times (.txt)", default=48, min=1)
+
+    def execute(self, context: Context):
+        name = os.path.splitext(os.path.basename(self.filepath))[0]
+        timed = self.filepath.lower().endswith('.srt')
+
+        with open(self.filepath, encoding='utf-8-sig', errors='replace') as file:
+            cues = read_cues(file, timed)
+
+            # The times (and texts) go on while the texts are shaped, each cue once
+            times = deque()
+            def cue_texts():
+                for start, end, text in cues:
+                    times.append((start, end, text))
+                    yield text
+
+            if self.target == 'OBJECTS':
+                add = self.get_object_adder(context, name)
+            else:
+                add = self.get_strip_adder(context, name)
+
+            count = 0
+            for count, shaped in enumerate(Fa.shape_texts(cue_texts()), 1):
+                start, end, text = times.popleft()
+                add(count, (start, end), text, shaped)
+
+        context.view_layer.update()
+        self.report({'INFO'}, f"Imported {count} cues")
+        return {'FINISHED'}
+
+    # A function to add each cue as a text object, in a new collection
+    def get_object_adder(self, context: Context, name):
+        collection = bpy.data.collections.new(name)
+        context.scene.collection.children.link(collection)
+        scene = context.scene
+        fps = scene.render.fps / scene.render.fps_base
+
+        def add(number, times, text, shaped):
+            curve = bpy.data.curves.new(f"{name} {number}", 'FONT')
+            curve.body = shaped
+            # The text of the cue, for editing and reshaping it (see Fa.state_property)
+            curve[Fa.state_property] = Fa.make_saved_state(text, shaped)
+            obj = bpy.data.objects.new(curve.name, curve)
+            obj.location.y = -(number - 1) * self.spacing
+
+            # Keep the times, for animating them
+            start, end = times
+            if start is not None:
+                obj["farsi_cue_start"] = scene.frame_start + round(start * fps)
+                obj["farsi_cue_end"] = scene.frame_start + round(end * fps)
+
+            collection.objects.link(obj)
+
+        return add
+
+    # A function to add each cue as a text strip, at its time (or after the previous one)
+    def get_strip_adder(self, context: Context, name):
+        scene = context.scene
+        if scene.sequence_editor is None:
+            scene.sequence_editor_create()
+        sequences = scene.sequence_editor.sequences
+        fps = scene.render.fps / scene.render.fps_base
+        next_frame = [scene.frame_start]
+
+        def add(number, times, text, shaped):
+            start, end = times
+            if start is None:
+                frame_start = next_frame[0]
+                frame_end = frame_start + self.duration
+            else:
+                frame_start = scene.frame_start + round(start * fps)
+                frame_end = max(scene.frame_start + round(end * fps), frame_start + 1)
+            next_frame[0] = frame_end
+
+            strip = sequences.new_effect(name=f"{name} {number}", type='TEXT', channel=self.channel,
+                                         frame_start=frame_start, frame_end=frame_end)
+            strip.text = shaped
+
+        return add
+
+
+def menu_func_import(self, context: Context):
+    self.layout.operator(__OT_FarsiTextImport.bl_idname, text="Farsi/Arabic Text (.srt/.txt)")
+
+
+def register():
+    bpy.utils.register_class(__OT_FarsiTextImport)
+    bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
+
+def unregister():
+    bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
+    bpy.utils.unregister_class(__OT_FarsiTextImport)
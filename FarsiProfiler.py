@@ -0,0 +1,351 @@
+import bpy
+import cProfile
+import heapq
+import io
+import itertools
+import json
+import pstats
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from bpy.types import Operator, Panel, Context
+from bpy.props import BoolProperty, IntProperty, StringProperty
+from bpy_extras.io_utils import ExportHelper
+from . import FarsiText as Fa
+
+
+# Latency of the keystrokes: the operators of the add-on (and the timer that writes coalesced or
+# background edits) are recorded as keystrokes, with the time of the stages of the edit cycle
+# inside them and the font operators they call. Turned on from the sidebar (Farsi Text tab),
+# which wraps the stage functions of FarsiText (turning it off puts them back).
+#
+# The time of a stage is its own: the shaping done to place the cursor counts as shaping,
+# not as cursor. What isn't in any stage (the gap buffer, the operator) is "other".
+stage_functions = {
+    'shape': ((Fa, 'shape_line_map'),),
+    'unlink': ((Fa, 'get_logical_text'),),
+    'write': ((Fa.Text, 'write_lines'),),
+    'cursor': ((Fa.Text, 'place_visual_cursor'),),
+}
+stages = tuple(stage_functions) + ('other', 'total')
+
+
+# Counts of values (microseconds, operator calls) in powers of 2:
+# bucket i counts the values from 2 ** (i - 1) to 2 ** i (bucket 0 the zeros)
+class Histogram:
+
+    def __init__(self):
+        self.buckets = [0] * 32
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value):
+        self.buckets[min(int(value).bit_length(), 31)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    # The upper bound of the bucket of the percentile
+    def percentile(self, percent):
+        rank = self.count * percent / 100
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return min(2 ** bucket if bucket else 0, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count, "mean": self.mean(), "max": self.max,
+            "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99),
+            "buckets": [[2 ** bucket if bucket else 0, count] for bucket, count in enumerate(self.buckets) if count],
+        }
+
+
+# One keystroke being recorded: the time spent in each stage, and the operators called
+class Keystroke:
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+        self.thread = threading.get_ident()
+        self.seconds = {}
+        self.operators = Counter()
+        self.stack = ['other']
+        self.profile = None
+
+    def __enter__(self):
+        self.recorder.keystroke = self
+        if self.recorder.profile_count > 0:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.start = self.mark = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        end = time.perf_counter()
+        if self.profile is not None:
+            self.profile.disable()
+        self.add_time(end)
+        self.seconds['total'] = end - self.start
+        self.recorder.keystroke = None
+        self.recorder.add(self)
+
+    # The time since the last mark goes to the stage on top
+    def add_time(self, now):
+        stage = self.stack[-1]
+        self.seconds[stage] = self.seconds.get(stage, 0) + now - self.mark
+        self.mark = now
+
+    def enter(self, stage):
+        self.add_time(time.perf_counter())
+        self.stack.append(stage)
+
+    def leave(self):
+        self.add_time(time.perf_counter())
+        self.stack.pop()
+
+
+class Recorder:
+    enabled = False
+    keystroke = None
+
+    # The slowest keystrokes are kept (slowest_count, or profile_count when it's more).
+    # With profile_count, every keystroke is profiled with cProfile (0: none is).
+    profile_count = 0
+    slowest_count = 10
+
+    def __init__(self):
+        self.originals = {}
+        self.reset()
+
+    def reset(self):
+        self.histograms = {stage: Histogram() for stage in stages}
+        self.operator_calls = Histogram()
+        self.operators = Counter()
+        self.count = 0
+        self.sequence = itertools.count()
+        # Heap of (seconds, sequence, Keystroke)
+        self.slowest = []
+
+    # Record the code in a with block as a keystroke
+    def record(self, name):
+        if not self.enabled or self.keystroke is not None:
+            return nullcontext()
+        return Keystroke(self, name)
+
+    def add(self, keystroke):
+        self.count += 1
+        for stage, seconds in keystroke.seconds.items():
+            self.histograms[stage].add(seconds * 1e6)
+        self.operator_calls.add(sum(keystroke.operators.values()))
+        self.operators.update(keystroke.operators)
+
+        entry = (keystroke.seconds['total'], next(self.sequence), keystroke)
+        if len(self.slowest) < max(self.slowest_count, self.profile_count):
+            heapq.heappush(self.slowest, entry)
+        else:
+            heapq.heappushpop(self.slowest, entry)
+
+    def get_slowest(self):
+        return [keystroke for seconds, sequence, keystroke in sorted(self.slowest, reverse=True)]
+
+    def enable(self):
+        if self.enabled:
+            return
+        for stage, functions in stage_functions.items():
+            for owner, name in functions:
+                function = getattr(owner, name)
+                self.originals[owner, name] = function
+                setattr(owner, name, self.wrap(stage, function))
+        Fa.bpy = OperatorCounter(self)
+        self.enabled = True
+
+    def disable(self):
+        if not self.enabled:
+            return
+        for (owner, name), function in self.originals.items():
+            setattr(owner, name, function)
+        self.originals.clear()
+        Fa.bpy = bpy
+        self.enabled = False
+
+    # function, timed as stage when it's called in a keystroke (not in the worker thread)
+    def wrap(self, stage, function):
+        def timed(*args, **kwargs):
+            keystroke = self.keystroke
+            if keystroke is None or keystroke.thread != threading.get_ident():
+                return function(*args, **kwargs)
+            keystroke.enter(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                keystroke.leave()
+        return timed
+
+    def to_dict(self):
+        slowest = []
+        for keystroke in self.get_slowest():
+            entry = {"name": keystroke.name, "seconds": keystroke.seconds, "operators": dict(keystroke.operators)}
+            if keystroke.profile is not None:
+                stream = io.StringIO()
+                pstats.Stats(keystroke.profile, stream=stream).sort_stats('cumulative').print_stats(30)
+                entry["profile"] = stream.getvalue()
+            slowest.append(entry)
+
+        return {
+            "keystrokes": self.count,
+            "stages_us": {stage: histogram.to_dict() for stage, histogram in self.histograms.items()},
+            "operator_calls": self.operator_calls.to_dict(),
+            "operators": dict(self.operators),
+            "slowest": slowest,
+        }
+
+recorder = Recorder()
+
+
+# Stands in for bpy in FarsiText while recording: counts the font operators it calls
+class OperatorCounter:
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.ops = self
+        self.font = self
+
+    def __getattr__(self, name):
+        operator = getattr(bpy.ops.font, name)
+
+        def call(*args, **kwargs):
+            keystroke = self.recorder.keystroke
+            if keystroke is not None:
+                keystroke.operators[name] += 1
+            return operator(*args, **kwargs)
+        return call
+
+
+def enabled_changed(self, context: Context):
+    if context.window_manager.farsi_profiling:
+        recorder.enable()
+    else:
+        recorder.disable()
+
+def profile_count_changed(self, context: Context):
+    recorder.profile_count = context.window_manager.farsi_profile_count
+
+
+def format_microseconds(value):
+    if value < 1000:
+        return f"{value:.0f} µs"
+    return f"{value / 1000:.1f} ms"
+
+
+class __PT_FarsiTextLatency(Panel):
+    bl_idname = "VIEW3D_PT_farsi_text_latency"
+    bl_label = "Typing Latency"
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = "Farsi Text"
+    bl_options = {'DEFAULT_CLOSED'}
+
+    def draw(self, context: Context):
+        layout = self.layout
+        window_manager = context.window_manager
+        layout.prop(window_manager, "farsi_profiling")
+        layout.prop(window_manager, "farsi_profile_count")
+
+        if recorder.count:
+            layout.label(text=f"{recorder.count} keystrokes")
+
+            column = layout.column(align=True)
+            row = column.row()
+            for title in ("Stage", "Mean", "p95", "Max"):
+                row.label(text=title)
+            for stage in stages:
+                histogram = recorder.histograms[stage]
+                if not histogram.count:
+                    continue
+                row = column.row()
+                row.label(text=stage.title())
+                for value in (histogram.mean(), histogram.percentile(95), histogram.max):
+                    row.label(text=format_microseconds(value))
+
+            calls = recorder.operator_calls
+            layout.label(text=f"Operators per keystroke: {calls.mean():.1f} (p95 {calls.percentile(95)}, max {calls.max})")
+            for name, count in recorder.operators.most_common(4):
+                layout.label(text=f"    {name}: {count}")
+
+            column = layout.column(align=True)
+            column.label(text="Slowest:")
+            for keystroke in recorder.get_slowest()[:5]:
+                column.label(text=f"    {keystroke.name.replace('_', ' ').title()}: {format_microseconds(keystroke.seconds['total'] * 1e6)}")
+
+        row = layout.row()
+        row.operator("wm.farsi_text_latency_export", text="Export")
+        row.operator("wm.farsi_text_latency_reset", text="Reset")
+
+
+class __OT_FarsiTextLatencyExport(Operator, ExportHelper):
+    """Save the recorded keystroke latencies as JSON"""
+
+    bl_idname = "wm.farsi_text_latency_export"
+    bl_label = "Export Typing Latency"
+
+    filename_ext = ".json"
+    filter_glob: StringProperty(default="*.json", options={'HIDDEN'})
+
+    def execute(self, context: Context):
+        with open(self.filepath, 'w', encoding='utf-8') as file:
+            json.dump(recorder.to_dict(), file, indent=1)
+        self.report({'INFO'}, f"Saved {recorder.count} keystrokes")
+        return {'FINISHED'}
+
+
+class __OT_FarsiTextLatencyReset(Operator):
+    """Forget the recorded keystroke latencies"""
+
+    bl_idname = "wm.farsi_text_latency_reset"
+    bl_label = "Reset Typing Latency"
+
+    def execute(self, context: Context):
+        recorder.reset()
+        return {'FINISHED'}
+
+
+classes = (
+    __OT_FarsiTextLatencyExport,
+    __OT_FarsiTextLatencyReset,
+    __PT_FarsiTextLatency,
+)
+
+def register():
+    for cls in classes:
+        bpy.utils.register_class(cls)
+
+    # Window manager properties aren't saved in the file: recording is for this session only
+    bpy.types.WindowManager.farsi_profiling = BoolProperty(
+        name="Record Keystrokes",
+        description="Time the stages of every keystroke in Farsi texts (makes typing a little slower)",
+        default=False,
+        update=enabled_changed,
+    )
+    bpy.types.WindowManager.farsi_profile_count = IntProperty(
+        name="Profile Slowest",
+        description="Profile the keystrokes with cProfile and keep the profiles of the slowest ones (0: don't profile)",
+        default=0, min=0, max=100,
+        update=profile_count_changed,
+    )
+
+def unregister():
+    recorder.disable()
+    recorder.reset()
+    del bpy.types.WindowManager.farsi_profiling
+    del bpy.types.WindowManager.farsi_profile_count
+
+    for cls in reversed(classes):
+        bpy.utils.unregister_class(cls)
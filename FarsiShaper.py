@@ -0,0 +1,774 @@
+# Farsi/Arabic shaping, without Blender: link (shape) logical text into the presentation forms
+# Blender shows, in visual order, and unlink it back. FarsiText builds the text editor on it.
+#
+# Importing it only needs the standard library (and nothing slow to import), so it can be used
+# in worker processes, scripts and tools: the tables are built when they're first needed and
+# NumPy/process pools are only imported when they're used.
+
+import os
+import sys
+from _collections import deque   # collections takes longer to import
+from itertools import islice
+from _thread import allocate_lock   # threading takes longer to import
+
+# general: (Isolated, Final, Initial)
+farsi_chars = {
+    'ا': (0xFE8D, True, False),
+    'أ': (0xFE83, True, False),
+    'إ': (0xFE87, True, False),
+    'آ': (0xFE81, True, False),
+    'ء': (0xFE80, False, False),
+    'ب': (0xFE8F, True, True),
+    'پ': (0xFB56, True, True),
+    'ت': (0xFE95, True, True),
+    'ث': (0xFE99, True, True),
+    'ج': (0xFE9D, True, True),
+    'چ': (0xFB7A, True, True),
+    'ح': (0xFEA1, True, True),
+    'خ': (0xFEA5, True, True),
+    'د': (0xFEA9, True, False),
+    'ذ': (0xFEAB, True, False),
+    'ر': (0xFEAD, True, False),
+    'ز': (0xFEAF, True, False),
+    'ژ': (0xFB8A, True, False),
+    'س': (0xFEB1, True, True),
+    'ش': (0xFEB5, True, True),
+    'ص': (0xFEB9, True, True),
+    'ض': (0xFEBD, True, True),
+    'ط': (0xFEC1, True, True),
+    'ظ': (0xFEC5, True, True),
+    'ع': (0xFEC9, True, True),
+    'غ': (0xFECD, True, True),
+    'ف': (0xFED1, True, True),
+    'ق': (0xFED5, True, True),
+    'ك': (0xFED9, True, True),
+    'ک': (0xFB8E, True, True),
+    'گ': (0xFB92, True, True),
+    'ل': (0xFEDD, True, True),
+    'م': (0xFEE1, True, True),
+    'ن': (0xFEE5, True, True),
+    'ه': (0xFEE9, True, True),
+    'ة': (0xFE93, True, False),
+    'و': (0xFEED, True, False),
+    'ؤ': (0xFE85, True, False),
+    'ي': (0xFEF1, True, True),
+    'ی': (0xFEEF, True, True),
+    'ئ': (0xFE89, True, True),
+}
+
+combinations = {
+    'لا': 0xFEFB,
+    'لأ': 0xFEF7,
+    'لإ': 0xFEF9,
+    'لآ': 0xFEF5,
+}
+
+def find_combination(current_char: str, next_char: str):
+    for combination, char_code in combinations.items():
+        if combination[0] == current_char and combination[1] == next_char:
+            return char_code
+    return 0
+
+chars_farsi_symbols = ['ـ', '،', '؟', '×', '÷']
+chars_common = [' ', '.', ',', ':', '|', '(', ')', '[', ']', '{', '}', '!', '+', '-', '*', '/', '\\', '%', '"', '\'', '>', '<', '=', '~', '_']
+chars_digits = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']
+
+# Check if a letter should be connected to the letter preceding it
+def can_be_final(c):
+    if c not in farsi_chars:
+        return False
+    return farsi_chars[c][1]
+
+
+# Check if a letter should be connected to the letter next to it
+def can_be_initial(c):
+    if c not in farsi_chars:
+        return False
+    return farsi_chars[c][2]
+
+# Get the location (unicode id) of an Farsi letter shapes (when connected)
+def get_char_variants_base(c):
+    if c not in farsi_chars:   # It's not an Farsi char
+        return -1
+    return farsi_chars[c][0]
+
+#
+def is_farsi_char(c):
+    if c == 'ـ': # Low line
+        return True
+    if c in farsi_chars:
+        return True
+    return False
+
+
+# Farsi char variants are located at 0xFE70 to  0xFEFE on unicode fonts.
+def is_farsi_char_variant(c):
+    if ord(c) >= 0xFE70 and ord(c) <= 0xFEFE:
+        return True
+    return False
+
+
+# Get the previous character from a buffer or text array
+def get_previous_alphabet(index, text):
+    index -= 1
+    while index > 0 and (text[index] in chars_common or text[index] in chars_digits or text[index] in chars_farsi_symbols):
+        index -= 1
+    if index >= 0:
+        return text[index]
+    else:
+        return None
+
+# Get the next character from a buffer or text array
+def get_next_alphabet(index, text):
+    index += 1
+    while index < len(text) and (text[index] in chars_common or text[index] in chars_digits or text[index] in chars_farsi_symbols):
+        index += 1
+
+    if index < len(text):
+        return text[index]
+    else:
+        return None
+
+# Shaping tables, built from farsi_chars and combinations the first time they are needed
+# (see load_tables), so importing this module is fast
+
+# Character classes, so every character is classified with a single lookup
+CLASS_OTHER = 0
+CLASS_LETTER = 1
+CLASS_SYMBOL = 2
+CLASS_COMMON = 3
+
+# Contextual forms of every Farsi letter: (Isolated, Final, Initial, Medial)
+# The isolated form is the letter itself. 'ی' has no initial/medial forms of its own,
+# it borrows those of 'ي', hence the special offsets.
+def build_forms_table():
+    forms = {}
+    for c, (char_code, _, _) in farsi_chars.items():
+        offset = 2 if c == 'ی' else 0
+        forms[c] = (ord(c), char_code + 1, char_code + 2 + offset, char_code + 3 + offset)
+    return forms
+
+tables_loaded = False
+
+def load_tables():
+    global forms_table, joins_previous, joins_next, combination_starts, neutral_chars
+    global digit_chars, farsi_letters, char_classes, unlink_table, tables_loaded
+
+    forms_table = build_forms_table()
+
+    # Letters that connect to the letter preceding / next to them
+    joins_previous = frozenset(c for c, (_, final, _) in farsi_chars.items() if final)
+    joins_next = frozenset(c for c, (_, _, initial) in farsi_chars.items() if initial)
+
+    # First letters of the "Lem-Alef" ligatures
+    combination_starts = frozenset(combination[0] for combination in combinations)
+
+    # Characters that get_previous_alphabet / get_next_alphabet skip over
+    neutral_chars = frozenset(chars_common + chars_digits + chars_farsi_symbols)
+    digit_chars = frozenset(chars_digits)
+    farsi_letters = frozenset(farsi_chars) | {'ـ'}
+
+    char_classes = {}
+    char_classes.update((c, CLASS_COMMON) for c in chars_common)
+    char_classes.update((c, CLASS_SYMBOL) for c in chars_farsi_symbols)
+    char_classes.update((c, CLASS_LETTER) for c in farsi_chars)
+
+    unlink_table = build_unlink_table()
+    tables_loaded = True
+
+table_names = ('forms_table', 'joins_previous', 'joins_next', 'combination_starts', 'neutral_chars',
+               'digit_chars', 'farsi_letters', 'char_classes', 'unlink_table')
+
+# The tables are module attributes too, loaded when they're first asked for
+def __getattr__(name):
+    if name in table_names and not tables_loaded:
+        load_tables()
+        return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Link the Farsi letters of a single line (text[start:end]) and return it in visual order.
+#
+# Farsi letters are written from right to left, so they are always put at the visual start
+# of the line. Spaces, punctuation, digits and Latin letters keep the placement rules of the
+# original implementation, but instead of rescanning the buffer for every character we keep
+# track of what those rules look at while we walk the line once:
+#   - the last/next non-neutral character (get_previous_alphabet/get_next_alphabet)
+#   - how many glyphs at the visual line start are not Farsi variants / are digits
+#
+# Glyphs are put char_pos glyphs from the visual line start. visual is a deque of the line in
+# reversed visual order, rotated so that where the last glyph went (the gap) is at its ends:
+# the next glyph usually goes there (a Latin run, one glyph further each time) or at one end
+# of the line (Farsi letters, a line without them), which are next to each other in the deque.
+# Rotating only moves the glyphs in between, where inserting in a list moved all the glyphs
+# after it (quadratic for long runs).
+#
+# When sources is a list, it receives (offset in the line, left to right) for every glyph,
+# in visual order (see LineMap).
+def link_line(text, start, end, sources=None):
+    if not tables_loaded:
+        load_tables()
+    
+    visual = deque()    # Reversed visual order, from the gap on and then before it
+    after_gap = 0       # Number of glyphs from the gap to the visual line start
+    placed_sources = deque()    # The same for sources
+    lead = 0            # Number of glyphs at the visual line start that are not Farsi variants
+    lead_digits = 0     # Number of digits at the visual line start
+    last_stop = start - 1 if start > 0 else -1  # Last char get_previous_alphabet would return
+    farsi_stop = -1     # Last stop that is a Farsi letter
+    after_farsi = -1    # First stop after farsi_stop
+    next_stop = start   # Next char get_next_alphabet would return (cached)
+
+    i = start
+    while i < end:
+        current_char = text[i]
+        char_class = char_classes.get(current_char, CLASS_OTHER)
+        char_pos = 0
+        width = 1
+
+        char_code = 0
+        if current_char in combination_starts and i + 1 < end:
+            char_code = combinations.get(current_char + text[i + 1], 0)
+
+        if char_code != 0:
+            if i > start and text[i - 1] in joins_next:
+                char_code += 1
+            glyph = chr(char_code)
+            width = 2
+
+        elif char_class == CLASS_LETTER:
+            form = 0
+            if i > start and current_char in joins_previous and text[i - 1] in joins_next:
+                form += 1
+            if i + 1 < end and current_char in joins_next and text[i + 1] in joins_previous:
+                form += 2
+            glyph = chr(forms_table[current_char][form])
+
+        elif char_class == CLASS_SYMBOL:
+            glyph = current_char
+
+        # Common characters follows the direction of the previous text (RTL or LTR)
+        elif char_class == CLASS_COMMON:
+            glyph = current_char
+            previous_alpha = text[last_stop] if last_stop >= 0 else None
+            if previous_alpha not in farsi_letters and previous_alpha != '\n':
+                if next_stop <= i:
+                    next_stop = i + 1
+                    while next_stop < end and text[next_stop] in neutral_chars:
+                        next_stop += 1
+                if next_stop >= end or text[next_stop] not in farsi_letters:
+                    char_pos = lead
+
+        # Do not reverse non-Farsi characters
+        else:
+            glyph = current_char
+            if lead_digits > 0:
+                char_pos = lead_digits
+            elif farsi_stop < 0:
+                char_pos = len(visual)
+            elif after_farsi >= 0:
+                char_pos = min(i - after_farsi, len(visual))
+
+        if char_pos != after_gap:
+            visual.rotate(char_pos - after_gap)
+            if sources is not None:
+                placed_sources.rotate(char_pos - after_gap)
+            after_gap = char_pos
+
+        # Glyphs at the line start are followed by the gap, the others are put before it
+        # (the next glyph of a Latin run goes before them)
+        if char_pos == 0:
+            visual.append(glyph)
+        else:
+            visual.appendleft(glyph)
+            after_gap += 1
+        if sources is not None:
+            source = (i - start, char_pos > 0 or (char_class == CLASS_OTHER and width == 1))
+            if char_pos == 0:
+                placed_sources.append(source)
+            else:
+                placed_sources.appendleft(source)
+
+        if char_pos <= lead:
+            lead = char_pos if 0xFE70 <= ord(glyph) <= 0xFEFE else lead + 1
+        if char_pos <= lead_digits:
+            lead_digits = lead_digits + 1 if glyph in digit_chars else char_pos
+
+        for index in range(i, i + width):
+            c = text[index]
+            if index == 0 or c not in neutral_chars:
+                last_stop = index
+                if c in farsi_letters:
+                    farsi_stop = index
+                    after_farsi = -1
+                elif farsi_stop >= 0 and after_farsi < 0:
+                    after_farsi = index
+
+        i += width
+
+    visual.rotate(-after_gap)
+    if sources is not None:
+        placed_sources.rotate(-after_gap)
+        sources.extend(reversed(placed_sources))
+    return ''.join(reversed(visual))
+
+
+# Link Farsi letters
+# The result is in visual order, with the lines in reverse order (see swap_lines)
+def link_text(unlinked_text):
+    text = ''.join(unlinked_text)
+    linked_lines = []
+    start = 0
+
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            linked_lines.append(link_line(text, start, len(text)))
+            break
+        linked_lines.append(link_line(text, start, end))
+        start = end + 1
+
+    linked_lines.reverse()
+    return '\n'.join(linked_lines)
+
+
+# Where the characters of a shaped line ended up.
+#   logical_to_visual[i]: the glyph of the i-th character of the line
+#   visual_to_logical[v]: the (first) character of the v-th glyph
+# Both characters of a "Lem-Alef" map to the same glyph.
+class LineMap:
+    __slots__ = ('logical_to_visual', 'visual_to_logical', 'left_to_right')
+
+    def __init__(self, length, sources):
+        self.logical_to_visual = [-1] * length
+        self.visual_to_logical = [offset for offset, _ in sources]
+        self.left_to_right = bytes(ltr for _, ltr in sources)
+
+        for v, offset in enumerate(self.visual_to_logical):
+            self.logical_to_visual[offset] = v
+        for i in range(1, length):
+            if self.logical_to_visual[i] == -1:
+                self.logical_to_visual[i] = self.logical_to_visual[i - 1]
+
+    def __len__(self):
+        return len(self.logical_to_visual)
+
+    # Visual column of the cursor that is before the character at offset (or at the end of the line)
+    def cursor_column(self, offset):
+        if offset < len(self.logical_to_visual):
+            v = self.logical_to_visual[offset]
+            # The cursor between "Lem" and "Alef" goes after the glyph, like at the end of a word
+            if offset > 0 and self.logical_to_visual[offset - 1] == v:
+                return v + self.left_to_right[v]
+            return v + 1 - self.left_to_right[v]
+
+        if offset == 0:
+            return 0
+        v = self.logical_to_visual[offset - 1]
+        return v + self.left_to_right[v]
+
+
+# Link a single logical line, the result is the line as it appears in the 3D text, and
+# map its characters between logical and visual order.
+# Shaping is line-local, so swap_lines(link_text(text)) is the same as shaping every line
+# of the text on its own. Only the first line of a text has nothing before it.
+def link_line_map(line, first_line=False):
+    sources = []
+    shaped = link_single_line(line, first_line, sources)
+    return shaped, LineMap(len(line), sources)
+
+
+# Link a single logical line like link_line_map, without making its LineMap
+def link_single_line(line, first_line=False, sources=None):
+    if first_line:
+        return link_line(line, 0, len(line), sources)
+    return link_line('\n' + line, 1, len(line) + 1, sources)
+
+
+# Least recently used cache of shaped lines, keyed by their logical content.
+# Lines that didn't change (or that are repeated) don't get linked again.
+class LineCache:
+
+    def __init__(self, max_size=1024):
+        self.entries = {}   # In order of use, the least recently used first
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # Lines are also shaped in worker threads (see FarsiText.ShapingJob)
+        self.lock = allocate_lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries[key] = entry
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            if self.max_size > 0:
+                self.entries.pop(key, None)
+                self.entries[key] = entry
+                self.trim()
+
+    # Change the number of lines the cache keeps (0 turns it off)
+    def resize(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            self.trim()
+
+    def trim(self):
+        while len(self.entries) > max(self.max_size, 0):
+            del self.entries[next(iter(self.entries))]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+line_cache = LineCache()
+
+
+# Shape a line (see link_line_map), through line_cache
+def shape_line_map(line, first_line=False):
+    key = (line, first_line)
+    entry = line_cache.get(key)
+    if entry is None:
+        entry = link_line_map(line, first_line)
+        line_cache.put(key, entry)
+    return entry
+
+
+def shape_line(line, first_line=False):
+    return shape_line_map(line, first_line)[0]
+
+
+# Shape a whole text, the same as swap_lines(link_text(text)) but through line_cache
+# (or with NumPy for texts of vector_threshold chars or more)
+def shape_text(unlinked_text):
+    text = ''.join(unlinked_text)
+    if len(text) >= vector_threshold and load_numpy():
+        return shape_text_vectorized(text)
+    
+    lines = text.split('\n')
+    return '\n'.join(shape_line(line, number == 0) for number, line in enumerate(lines))
+
+
+# Shape a whole text like shape_text, for texts that are only shaped once (scripts, files, bakes):
+# without the LineMaps, and without line_cache, which they would fill with lines of no use to
+# the editor
+def shape_text_once(unlinked_text):
+    text = ''.join(unlinked_text)
+    if len(text) >= vector_threshold and load_numpy():
+        return shape_text_vectorized(text)
+    return link_lines(text)
+
+
+vector_threshold = 65536
+vector_tables = None
+
+# NumPy is optional, and slow to import, so it's only imported for the first big text
+numpy = None
+numpy_checked = False
+
+def load_numpy():
+    global numpy, numpy_checked
+    if not numpy_checked:
+        numpy_checked = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy is not None
+
+# Lookup arrays of the Basic Multilingual Plane for shape_text_vectorized:
+# the class and joining of every char, and its glyph for each form (forms[form, char])
+def build_vector_tables():
+    if not tables_loaded:
+        load_tables()
+    
+    size = 0x10000
+    classes = numpy.zeros(size, numpy.uint8)
+    for c, char_class in char_classes.items():
+        classes[ord(c)] = char_class
+    
+    joins_previous_array = numpy.zeros(size, bool)
+    joins_previous_array[[ord(c) for c in joins_previous]] = True
+    joins_next_array = numpy.zeros(size, bool)
+    joins_next_array[[ord(c) for c in joins_next]] = True
+    
+    forms = numpy.tile(numpy.arange(size, dtype=numpy.uint32), (4, 1))
+    for c, char_forms in forms_table.items():
+        forms[:, ord(c)] = char_forms
+    
+    pairs = [(ord(combination[0]), ord(combination[1]), char_code) for combination, char_code in combinations.items()]
+    return classes, joins_previous_array, joins_next_array, forms, pairs
+
+
+# Shape a whole text line by line with link_single_line, the same as swap_lines(link_text(text))
+def link_lines(text):
+    return '\n'.join(link_single_line(line, number == 0) for number, line in enumerate(text.split('\n')))
+
+
+# Shape a whole text like shape_text, with a few NumPy operations over all its chars:
+# every letter gets its form from its neighbours (shifted arrays) and the lines are reversed.
+# That's all there is to lines of Farsi letters, spaces and punctuation. Lines with other chars
+# (digits, Latin letters, ...) need the placement rules of link_line, so they are shaped with it,
+# and so is the whole text when they are most of it (bilingual text).
+def shape_text_vectorized(text):
+    global vector_tables
+    if vector_tables is None:
+        load_numpy()
+        vector_tables = build_vector_tables()
+    classes, joins_previous_array, joins_next_array, forms, pairs = vector_tables
+    
+    if not text:
+        return text
+    
+    newline = ord('\n')
+    chars = numpy.frombuffer(text.encode('utf-32-le', 'surrogatepass'), numpy.uint32)
+    # Chars out of the tables are "other" chars, their lines are shaped by link_line
+    chars = numpy.minimum(chars, 0xFFFF)
+    char_classes_array = classes[chars]
+    is_newline = chars == newline
+    
+    line_numbers = numpy.cumsum(is_newline)
+    other_lines = numpy.unique(line_numbers[(char_classes_array == CLASS_OTHER) & ~is_newline])
+    # Nothing is before the first line, so its leading neutral chars are placed like in LTR text
+    if char_classes_array[0] != CLASS_LETTER and chars[0] != newline:
+        other_lines = numpy.union1d(other_lines, [0])
+    if 2 * numpy.isin(line_numbers, other_lines).sum() > len(chars):
+        return link_lines(text)
+    
+    previous_chars = numpy.concatenate(([newline], chars[:-1]))
+    next_chars = numpy.concatenate((chars[1:], [newline]))
+    
+    # Forms of the letters: +1 when joined to the previous letter, +2 when joined to the next
+    form = joins_previous_array[chars] & joins_next_array[previous_chars]
+    form = form + 2 * (joins_next_array[chars] & joins_previous_array[next_chars])
+    form *= char_classes_array == CLASS_LETTER
+    glyphs = forms[form, chars]
+    
+    # "Lem-Alef": the pair becomes one glyph
+    keep = numpy.ones(len(chars), bool)
+    for first, second, char_code in pairs:
+        pair = (chars == first) & (next_chars == second)
+        glyphs[pair] = char_code + joins_next_array[previous_chars[pair]]
+        keep[1:][pair[:-1]] = False
+    
+    # Reverse every line: the char at p of a line [start, end) goes to start + end - 1 - p
+    glyphs = glyphs[keep]
+    is_newline = is_newline[keep]
+    breaks = numpy.flatnonzero(is_newline)
+    starts = numpy.concatenate(([0], breaks + 1))
+    ends = numpy.concatenate((breaks, [len(glyphs)]))
+    line_numbers = numpy.cumsum(is_newline)
+    positions = numpy.arange(len(glyphs))
+    targets = numpy.where(is_newline, positions, starts[line_numbers] + ends[line_numbers] - 1 - positions)
+    shaped = numpy.empty_like(glyphs)
+    shaped[targets] = glyphs
+    
+    shaped_lines = shaped.astype('<u4').tobytes().decode('utf-32-le', 'surrogatepass').split('\n')
+    if len(other_lines):
+        lines = text.split('\n')
+        for number in other_lines.tolist():
+            shaped_lines[number] = link_single_line(lines[number], number == 0)
+    return '\n'.join(shaped_lines)
+
+
+# Shape many texts (in logical order) for scripts, without bpy: yields shape_text_once() of each of
+# them, in order, as they are done. With processes (a number, or True for one per core) the texts
+# are shaped in a process pool, chunk_size texts at a time, with a few chunks in flight at once.
+def shape_texts(unlinked_texts, processes=None, chunk_size=64):
+    if not processes:
+        for unlinked_text in unlinked_texts:
+            yield shape_text_once(unlinked_text)
+        return
+    
+    from concurrent.futures import ProcessPoolExecutor
+    
+    max_workers = os.cpu_count() if processes is True else processes
+    shape_chunk = get_worker_module().shape_text_chunk
+    texts = iter(unlinked_texts)
+    chunks = []
+    
+    with ProcessPoolExecutor(max_workers) as executor:
+        while True:
+            while len(chunks) < 2 * max_workers:
+                chunk = list(islice(texts, chunk_size))
+                if not chunk:
+                    break
+                chunks.append(executor.submit(shape_chunk, chunk))
+            
+            if not chunks:
+                return
+            yield from chunks.pop(0).result()
+
+
+def shape_text_chunk(unlinked_texts):
+    return [shape_text_once(unlinked_text) for unlinked_text in unlinked_texts]
+
+
+# Worker processes import the function they run by the name of its module. In the add-on
+# that's in the package, which needs bpy, so they get this file as a top-level module instead.
+def get_worker_module():
+    if not __package__:
+        return sys.modules[__name__]
+    
+    directory = os.path.dirname(os.path.abspath(__file__))
+    if directory not in sys.path:
+        sys.path.append(directory)
+    return __import__(__name__.rpartition('.')[2])
+
+
+# Shape a whole text (like swap_lines(link_text(text))) and map every logical index to its
+# index in the shaped text and back. Line breaks map to line breaks.
+def shape_text_map(unlinked_text):
+    text = ''.join(unlinked_text)
+    shaped_lines = []
+    logical_to_visual = []
+    visual_to_logical = []
+    logical_start = 0
+    visual_start = 0
+
+    for number, line in enumerate(text.split('\n')):
+        if number > 0:
+            logical_to_visual.append(visual_start)
+            visual_to_logical.append(logical_start)
+            logical_start += 1
+            visual_start += 1
+
+        shaped, line_map = shape_line_map(line, number == 0)
+        shaped_lines.append(shaped)
+        logical_to_visual.extend(visual_start + v for v in line_map.logical_to_visual)
+        visual_to_logical.extend(logical_start + i for i in line_map.visual_to_logical)
+        logical_start += len(line)
+        visual_start += len(shaped)
+
+    return '\n'.join(shaped_lines), logical_to_visual, visual_to_logical
+
+
+# swap lines
+
+# When we reverse the order of our characters (to show farsi text correctly), we will get our lines of text swaped
+# so we have to swap our text lines back to make it shown correctly
+def swap_lines(linked_text):
+    lines = ''.join(linked_text).split('\n')
+    lines.reverse()
+    return '\n'.join(lines)
+
+
+# Presentation form -> base letter(s), the inverse of forms_table and combinations
+# When two letters share a form (like 'ي' and 'ی') the first one in farsi_chars wins.
+def build_unlink_table():
+    table = {}
+    for c, (char_code, final, initial) in farsi_chars.items():
+        forms = forms_table[c]
+        codes = [char_code]
+        if final:
+            codes.append(forms[1])
+        if initial:
+            codes.append(forms[2])
+            if final:
+                codes.append(forms[3])
+        for code in codes:
+            table.setdefault(chr(code), c)
+
+    for combination, char_code in combinations.items():
+        table[chr(char_code)] = combination
+        table[chr(char_code + 1)] = combination
+
+    return table
+
+
+# Unlink farsi text (get the original text before it gets connected)
+def unlink_text(linked_text):
+    if not tables_loaded:
+        load_tables()
+    
+    unlinked_text = []
+    get = unlink_table.get
+
+    for c in reversed(linked_text):
+        unlinked_text.extend(get(c, c))
+
+    return unlinked_text
+
+
+
+# Presentation forms: what link_text turns Farsi/Arabic letters into (isolated ones stay letters)
+def is_presentation_form(c):
+    return '\ufb50' <= c <= '\ufdff' or '\ufe70' <= c <= '\ufefe'
+
+
+# Shape a line of a body again, from the line unlinked (the first line of the body if first_line).
+# A line without presentation forms is kept: it wasn't shaped, or has nothing to shape. So is a
+# line that unlinking can't have given back as it was typed: when its unlinked text doesn't
+# come back from shaping it (unlink_text gives Latin and digit runs back reversed), or when
+# shaping it would join letters that weren't joined (or the other way around).
+def reshape_line(line, first_line=False):
+    joined = [is_presentation_form(c) for c in line]
+    if not any(joined):
+        return line
+    
+    text = ''.join(unlink_text(line))
+    shaped = link_single_line(text, first_line)
+    if ''.join(unlink_text(shaped)) != text or [is_presentation_form(c) for c in shaped] != joined:
+        return line
+    return shaped
+
+
+# Shape a body again line by line (see reshape_line), for texts without their logical text
+def reshape_body(body):
+    return '\n'.join(reshape_line(line, number == 0) for number, line in enumerate(body.split('\n')))
+
+# Blender only keeps the shaped body of a text, and unlinking it can't always give back what was
+# typed (Latin and digit runs come back reversed), so the logical text is kept on the curve too,
+# in its state_property custom property:
+#   {"text": the logical text, "cursor": index in it, "hash": hash_body() of the body it made}
+# It's only used while the body is still the one it was saved with.
+state_property = "farsi_text"
+
+def hash_body(body):
+    import hashlib  # Only when it's needed (see the top)
+    return hashlib.blake2b(body.encode(), digest_size=16).hexdigest()
+
+def make_saved_state(text, body, cursor=None):
+    return {"text": text, "cursor": len(text) if cursor is None else cursor, "hash": hash_body(body)}
+
+# The saved logical text of body (None when saved_state wasn't saved for it)
+def get_saved_text(body, saved_state):
+    if saved_state is not None and saved_state.get("hash") == hash_body(body):
+        return saved_state["text"]
+    return None
+
+# The logical text of body: the saved one, or body unlinked when there's none
+def get_logical_text(body, saved_state=None):
+    text = get_saved_text(body, saved_state)
+    if text is None:
+        text = ''.join(unlink_text(swap_lines(body)))
+    return text
+
+
+# Shape text curves again (Blender's TextCurves, or anything with a body and their custom
+# properties): from their saved logical text when they have one, else with reshape_body.
+# The saved state is updated with the body it makes. Returns how many bodies changed.
+def reshape_curves(curves):
+    changed = 0
+    for curve in curves:
+        saved_state = curve.get(state_property)
+        text = get_saved_text(curve.body, saved_state)
+        body = reshape_body(curve.body) if text is None else shape_text_once(text)
+        if curve.body != body:
+            curve.body = body
+            if text is not None:
+                curve[state_property] = make_saved_state(text, body, saved_state["cursor"])
+            changed += 1
+    return changed
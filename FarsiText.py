@@ -1,454 +1,367 @@
 import bpy
-import os
-
-# general: (Isolated, Final, Initial)
-farsi_chars = {
-    'ا': (0xFE8D, True, False),
-    'أ': (0xFE83, True, False),
-    'إ': (0xFE87, True, False),
-    'آ': (0xFE81, True, False),
-    'ء': (0xFE80, False, False),
-    'ب': (0xFE8F, True, True),
-    'پ': (0xFB56, True, True),
-    'ت': (0xFE95, True, True),
-    'ث': (0xFE99, True, True),
-    'ج': (0xFE9D, True, True),
-    'چ': (0xFB7A, True, True),
-    'ح': (0xFEA1, True, True),
-    'خ': (0xFEA5, True, True),
-    'د': (0xFEA9, True, False),
-    'ذ': (0xFEAB, True, False),
-    'ر': (0xFEAD, True, False),
-    'ز': (0xFEAF, True, False),
-    'ژ': (0xFB8A, True, False),
-    'س': (0xFEB1, True, True),
-    'ش': (0xFEB5, True, True),
-    'ص': (0xFEB9, True, True),
-    'ض': (0xFEBD, True, True),
-    'ط': (0xFEC1, True, True),
-    'ظ': (0xFEC5, True, True),
-    'ع': (0xFEC9, True, True),
-    'غ': (0xFECD, True, True),
-    'ف': (0xFED1, True, True),
-    'ق': (0xFED5, True, True),
-    'ك': (0xFED9, True, True),
-    'ک': (0xFB8E, True, True),
-    'گ': (0xFB92, True, True),
-    'ل': (0xFEDD, True, True),
-    'م': (0xFEE1, True, True),
-    'ن': (0xFEE5, True, True),
-    'ه': (0xFEE9, True, True),
-    'ة': (0xFE93, True, False),
-    'و': (0xFEED, True, False),
-    'ؤ': (0xFE85, True, False),
-    'ي': (0xFEF1, True, True),
-    'ی': (0xFEEF, True, True),
-    'ئ': (0xFE89, True, True),
-}
-
-combinations = {
-    'لا': 0xFEFB,
-    'لأ': 0xFEF7,
-    'لإ': 0xFEF9,
-    'لآ': 0xFEF5,
-}
-
-def find_combination(current_char: str, next_char: str):
-    for combination, char_code in combinations.items():
-        if combination[0] == current_char and combination[1] == next_char:
-            return char_code
-    return 0
-
-chars_farsi_symbols = ['ـ', '،', '؟', '×', '÷']
-chars_common = [' ', '.', ',', ':', '|', '(', ')', '[', ']', '{', '}', '!', '+', '-', '*', '/', '\\', '%', '"', '\'', '>', '<', '=', '~', '_']
-chars_digits = ['0', '1', '2', '3', '4', '5', '6', '7', '8', '9']
-
-# Check if a letter should be connected to the letter preceding it
-def can_be_final(c):
-    if c not in farsi_chars:
-        return False
-    return farsi_chars[c][1]
+import threading
+import sys
+from array import array
+from bisect import bisect_left
+from . import FarsiShaper
+from .FarsiShaper import shape_text, shape_line_map, get_logical_text, get_saved_text, make_saved_state
 
 
-# Check if a letter should be connected to the letter next to it
-def can_be_initial(c):
-    if c not in farsi_chars:
-        return False
-    return farsi_chars[c][2]
+# The shaping functions (link_text, unlink_text, swap_lines, shape_texts, ...) are in FarsiShaper,
+# which doesn't need Blender. They can still be used from here.
+def __getattr__(name):
+    return getattr(FarsiShaper, name)
 
-# Get the location (unicode id) of an Farsi letter shapes (when connected)
-def get_char_variants_base(c):
-    if c not in farsi_chars:   # It's not an Farsi char
-        return -1
-    return farsi_chars[c][0]
 
+# Text storage for the editor: a gap buffer with an index of the line breaks.
 #
-def is_farsi_char(c):
-    if c == 'ـ': # Low line
-        return True
-    if c in farsi_chars:
-        return True
-    return False
-
-
-# Farsi char variants are located at 0xFE70 to  0xFEFE on unicode fonts.
-def is_farsi_char_variant(c):
-    if ord(c) >= 0xFE70 and ord(c) <= 0xFEFE:
-        return True
-    return False
-
-
-# Get the previous character from a buffer or text array
-def get_previous_alphabet(index, text):
-    index -= 1
-    while index > 0 and (text[index] in chars_common or text[index] in chars_digits or text[index] in chars_farsi_symbols):
-        index -= 1
-    if index >= 0:
-        return text[index]
-    else:
-        return None
-
-# Get the next character from a buffer or text array
-def get_next_alphabet(index, text):
-    index += 1
-    while index < len(text) and (text[index] in chars_common or text[index] in chars_digits or text[index] in chars_farsi_symbols):
-        index += 1
-
-    if index < len(text):
-        return text[index]
-    else:
-        return None
-
-# Link Farsi letters
-def link_text(unlinked_text):
-    linked_text = []
-    previous_char = ""
-    next_char = ""
-    char_code = 0
-    skip_char = False
-
-    # When the letter "Alef" is connected to the letter "Lem" they become one letter
-    # but the buffer still contains the two
-    uncounted_chars = 0
-
-    for current_char in unlinked_text:
-        
-        if skip_char:
-            skip_char = False
-            continue
-
-        chars_count = len(linked_text) + uncounted_chars
-
-        previous_char = unlinked_text[chars_count - 1] if chars_count > 0 else ""
-        next_char = unlinked_text[chars_count + 1] if chars_count < len(unlinked_text) - 1 else ""
-
-        char_code = find_combination(current_char, next_char)
-        if char_code != 0:
-            if can_be_initial(previous_char):
-                char_code += 1
-            linked_text.insert(0, chr(char_code))
-            uncounted_chars += 1
-            skip_char = True
-            continue
-
-        if current_char in chars_farsi_symbols:
-            linked_text.insert(0, current_char)
-            continue
-
-        if current_char == '\n':
-            linked_text.insert(0, current_char)
-            continue
-
-        # Common characters follows the direction of the previous text (RTL or LTR)
-        if current_char in chars_common:
+# The characters before the gap are kept in order, the ones after it are kept reversed,
+# so editing at the gap (the cursor) only appends/pops at the end of an array. The positions
+# of the line breaks are kept the same way: absolute positions before the gap and positions
+# in the reversed array after it, so both lists stay sorted and move with the gap.
+
+# The chars are kept as code points: array('u') is wchar_t, 2 bytes on Windows before Python 3.13,
+# where a char out of the Basic Multilingual Plane (emoji) took two items and indices drifted.
+# They go in and out of the arrays as UTF-32 in the machine's byte order.
+char_typecode = 'I' if array('I').itemsize == 4 else 'L'
+char_encoding = 'utf-32-le' if sys.byteorder == 'little' else 'utf-32-be'
+
+def encode_chars(text):
+    return text.encode(char_encoding, 'surrogatepass')
+
+def decode_chars(chars):
+    return chars.tobytes().decode(char_encoding, 'surrogatepass')
+
+class GapBuffer:
+
+    def __init__(self, text=''):
+        self.before = array(char_typecode)
+        self.after = array(char_typecode)
+        self.before_lines = []
+        self.after_lines = []
+        self.insert(0, text)
+
+    def __len__(self):
+        return len(self.before) + len(self.after)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if index < len(self.before):
+            return chr(self.before[index])
+        if index >= len(self):
+            raise IndexError('GapBuffer index out of range')
+        return chr(self.after[len(self) - 1 - index])
+
+    def __iter__(self):
+        return iter(self.get_text())
+
+    def __str__(self):
+        return self.get_text()
+
+    # Move the gap to index
+    def move_gap(self, index):
+        before, after = self.before, self.after
+        
+        if index < len(before):
+            # Positions before the gap turn into positions in the reversed array
+            last = len(before) + len(after) - 1
+            cut = bisect_left(self.before_lines, index)
+            for position in reversed(self.before_lines[cut:]):
+                self.after_lines.append(last - position)
+            del self.before_lines[cut:]
             
-            previous_alpha = get_previous_alphabet(chars_count, unlinked_text)
-            next_alpha = get_next_alphabet(chars_count, unlinked_text)
+            chunk = before[index:]
+            del before[index:]
+            chunk.reverse()
+            after.extend(chunk)
             
-            char_pos = 0
-
-            if not is_farsi_char(previous_alpha) and not is_farsi_char(next_alpha) and previous_alpha != '\n':
-                
-                while char_pos < len(linked_text) and not is_farsi_char_variant(linked_text[char_pos]) and linked_text[char_pos] != '\n':
-                    char_pos += 1
+        elif index > len(before):
+            last = len(before) + len(after) - 1
+            size = len(after) - (index - len(before))
+            cut = bisect_left(self.after_lines, size)
+            for position in reversed(self.after_lines[cut:]):
+                self.before_lines.append(last - position)
+            del self.after_lines[cut:]
             
-            linked_text.insert(char_pos, current_char)
+            chunk = after[size:]
+            del after[size:]
+            chunk.reverse()
+            before.extend(chunk)
 
-            continue
-
-        # Other letters
-
-        char_code = get_char_variants_base(current_char)
+    def insert(self, index, text):
+        self.move_gap(index)
         
-        if char_code == -1:   # = Not an Farsi character
-
-            # Do not reverse non-Farsi characters
-
-            previous_alpha = get_previous_alphabet(chars_count, unlinked_text)
-            next_alpha = get_next_alphabet(chars_count, unlinked_text)
-
-            char_pos = 0
-
-            # Numbers
-
-            if len(linked_text) > 0 and linked_text[0] in chars_digits:
-                while char_pos < len(linked_text) and linked_text[char_pos] in chars_digits:
-                    char_pos +=1
-            
-            # Non-Farsi alhpabet
-
-            elif not is_farsi_char(previous_alpha):
-                c = chars_count - 1
-                while not is_farsi_char(previous_alpha) and char_pos < len(linked_text) and linked_text[char_pos] != '\n':
-                    previous_alpha = get_previous_alphabet(c, unlinked_text)
-                    char_pos += 1
-                    c -= 1
-
-            linked_text.insert(char_pos, current_char)
-
-            continue
-
-        # It's an Farsi alhpabet
-
-        if can_be_initial(previous_char) and can_be_final(current_char):
-
-            if can_be_initial(current_char) and can_be_final(next_char):
-                
-                if char_code == 65263: # ی
-                    char_code += 5
-                else:
-                    char_code += 3
-
-            else:
-
-                char_code += 1
-        else:
-
-            if can_be_initial(current_char) and can_be_final(next_char):
-                
-                if char_code == 65263:
-                    char_code += 4
-                else:
-                    char_code += 2
-            else:
-                char_code = ord(current_char)
-
-        linked_text.insert(0, chr(char_code))
-
-    text = ''.join(linked_text)
-
-    return text
-
-
-# swap lines
-
-# When we reverse the order of our characters (to show farsi text correctly), we will get our lines of text swaped
-# so we have to swap our text lines back to make it shown correctly
-def swap_lines(linked_text):
-
-    new_text = []
-    current_line_start = 0
-    char_counter = 0
-
-    for c in reversed(linked_text):
-        if c == '\n':
-            new_text.append('\n')
-            current_line_start = char_counter + 1
-            char_counter += 1
-            continue
-
-        new_text.insert(current_line_start, c)
-        char_counter += 1
-
-    return ''.join(new_text)
-
-
-# Unlink farsi text (get the original text before it gets connected)
-def unlink_text(linked_text):
-    unlinked_text = []
-
-    for c in linked_text:
-
-        if ord(c) in {0xFE8D, 0xFE8E}:
-            unlinked_text.insert(0, 'ا')
-
-        elif ord(c) in {0xFE83, 0xFE84}:
-            unlinked_text.insert(0, 'أ')
-
-        elif ord(c) in {0xFE87, 0xFE88}:
-            unlinked_text.insert(0, 'إ')
-
-        elif ord(c) in {0xFE81, 0xFE82}:
-            unlinked_text.insert(0, 'آ')
-
-        elif ord(c) in {0xFE80}:
-            unlinked_text.insert(0, 'ء')
-
-        elif ord(c) in {0xFE8F, 0xFE90, 0xFE91, 0xFE92}:
-            unlinked_text.insert(0, 'ب')
+        line_break = text.find('\n')
+        while line_break != -1:
+            self.before_lines.append(index + line_break)
+            line_break = text.find('\n', line_break + 1)
         
-        elif ord(c) in {0xFB56, 0xFB57, 0xFB58, 0xFB59}:
-            unlinked_text.insert(0, 'پ')
-
-        elif ord(c) in {0xFE95, 0xFE96, 0xFE97, 0xFE98}:
-            unlinked_text.insert(0, 'ت')
-
-        elif ord(c) in {0xFE99, 0xFE9A, 0xFE9B, 0xFE9C}:
-            unlinked_text.insert(0, 'ث')
+        self.before.frombytes(encode_chars(text))
 
-        elif ord(c) in {0xFE9D, 0xFE9E, 0xFE9F, 0xFEA0}:
-            unlinked_text.insert(0, 'ج')
+    # Delete count characters starting at index and return them
+    def delete(self, index, count=1):
+        self.move_gap(index)
         
-        elif ord(c) in {0xFB7A, 0xFB7B, 0xFB7C, 0xFB7D}:
-            unlinked_text.insert(0, 'چ')
-
-        elif ord(c) in {0xFEA1, 0xFEA2, 0xFEA3, 0xFEA4}:
-            unlinked_text.insert(0, 'ح')
-
-        elif ord(c) in {0xFEA5, 0xFEA6, 0xFEA7, 0xFEA8}:
-            unlinked_text.insert(0, 'خ')
-
-        elif ord(c) in {0xFEA9, 0xFEAA}:
-            unlinked_text.insert(0, 'د')
-
-        elif ord(c) in {0xFEAB, 0xFEAC}:
-            unlinked_text.insert(0, 'ذ')
-
-        elif ord(c) in {0xFEAD, 0xFEAE}:
-            unlinked_text.insert(0, 'ر')
-
-        elif ord(c) in {0xFEAF, 0xFEB0}:
-            unlinked_text.insert(0, 'ز')
-
-        elif ord(c) in {0xFB8A, 0xFB8B}:
-            unlinked_text.insert(0, 'ژ')
-
-        elif ord(c) in {0xFEB1, 0xFEB2, 0xFEB3, 0xFEB4}:
-            unlinked_text.insert(0, 'س')
-
-        elif ord(c) in {0xFEB5, 0xFEB6, 0xFEB7, 0xFEB8}:
-            unlinked_text.insert(0, 'ش')
-
-        elif ord(c) in {0xFEB9, 0xFEBA, 0xFEBB, 0xFEBC}:
-            unlinked_text.insert(0, 'ص')
-
-        elif ord(c) in {0xFEBD, 0xFEBE, 0xFEBF, 0xFEC0}:
-            unlinked_text.insert(0, 'ض')
-
-        elif ord(c) in {0xFEC1, 0xFEC2, 0xFEC3, 0xFEC4}:
-            unlinked_text.insert(0, 'ط')
-
-        elif ord(c) in {0xFEC5, 0xFEC6, 0xFEC7, 0xFEC8}:
-            unlinked_text.insert(0, 'ظ')
-
-        elif ord(c) in {0xFEC9, 0xFECA, 0xFECB, 0xFECC}:
-            unlinked_text.insert(0, 'ع')
-
-        elif ord(c) in {0xFECD, 0xFECE, 0xFECF, 0xFED0}:
-            unlinked_text.insert(0, 'غ')
-
-        elif ord(c) in {0xFED1, 0xFED2, 0xFED3, 0xFED4}:
-            unlinked_text.insert(0, 'ف')
-
-        elif ord(c) in {0xFED5, 0xFED6, 0xFED7, 0xFED8}:
-            unlinked_text.insert(0, 'ق')
-
-        elif ord(c) in {0xFED9, 0xFEDA, 0xFEDB, 0xFEDC}:
-            unlinked_text.insert(0, 'ك')
-
-        elif ord(c) in {0xFB8E, 0xFB8F, 0xFB90, 0xFB91}:
-            unlinked_text.insert(0, 'ﮎ')
-
-        elif ord(c) in {0xFB92, 0xFB93, 0xFB94, 0xFB95}:
-            unlinked_text.insert(0, 'گ')
-
-        elif ord(c) in {0xFEDD, 0xFEDE, 0xFEDF, 0xFEE0}:
-            unlinked_text.insert(0, 'ل')
-
-        elif ord(c) in {0xFEE1, 0xFEE2, 0xFEE3, 0xFEE4}:
-            unlinked_text.insert(0, 'م')
-
-        elif ord(c) in {0xFEE5, 0xFEE6, 0xFEE7, 0xFEE8}:
-            unlinked_text.insert(0, 'ن')
-
-        elif ord(c) in {0xFEE9, 0xFEEA, 0xFEEB, 0xFEEC}:
-            unlinked_text.insert(0, 'ه')
-
-        elif ord(c) in {0xFE93, 0xFE94}:
-            unlinked_text.insert(0, 'ة')
-
-        elif ord(c) in {0xFEED, 0xFEEE}:
-            unlinked_text.insert(0, 'و')
-
-        elif ord(c) in {0xFE85, 0xFE86}:
-            unlinked_text.insert(0, 'ؤ')
-
-        elif ord(c) in {0xFEF1, 0xFEF2, 0xFEF3, 0xFEF4}:
-            unlinked_text.insert(0, 'ي')
+        size = len(self.after) - count
+        del self.after_lines[bisect_left(self.after_lines, size):]
+        
+        chunk = self.after[size:]
+        del self.after[size:]
+        return decode_chars(chunk)[::-1]
+
+    def get_text(self, start=0, end=None):
+        size = len(self)
+        end = size if end is None else end
+        gap = len(self.before)
+        
+        text = decode_chars(self.before[start:min(end, gap)])
+        if end > gap:
+            text += decode_chars(self.after[size - end : size - max(start, gap)])[::-1]
+        return text
+
+    def count_lines(self):
+        return 1 + len(self.before_lines) + len(self.after_lines)
+
+    # The line index is in (the number of line breaks before index)
+    def line_of(self, index):
+        size = len(self)
+        line = bisect_left(self.before_lines, index)
+        line += len(self.after_lines) - bisect_left(self.after_lines, size - index)
+        return line
+
+    def line_start(self, line):
+        if line == 0:
+            return 0
+        
+        line -= 1
+        if line < len(self.before_lines):
+            return self.before_lines[line] + 1
+        
+        line -= len(self.before_lines)
+        return len(self) - self.after_lines[len(self.after_lines) - 1 - line]
 
-        elif ord(c) in {0xFEEF, 0xFEF0}:
-            unlinked_text.insert(0, 'ی')
+    # Where the line ends (its line break, or the end of the text)
+    def line_end(self, line):
+        if line + 1 < self.count_lines():
+            return self.line_start(line + 1) - 1
+        return len(self)
 
-        elif ord(c) in {0xFE89, 0xFE8A, 0xFE8B, 0xFE8C}:
-            unlinked_text.insert(0, 'ئ')
+    def get_line(self, line):
+        return self.get_text(self.line_start(line), self.line_end(line))
 
-        elif ord(c) in {0xFEFB, 0xFEFC}:
-            unlinked_text.insert(0, 'ا')
-            unlinked_text.insert(0, 'ل')
 
-        elif ord(c) in {0xFEF7, 0xFEF8}:
-            unlinked_text.insert(0, 'أ')
-            unlinked_text.insert(0, 'ل')
+# Shape lines in a worker thread (FarsiShaper doesn't use bpy), for Text to write when it's done.
+# lines are the unlinked lines from first_line on, results gets (shaped, LineMap) for each of them.
+# outdated: the lines were edited since it started, its results can't be written.
+class ShapingJob:
 
-        elif ord(c) in {0xFEF9, 0xFEFA}:
-            unlinked_text.insert(0, 'إ')
-            unlinked_text.insert(0, 'ل')
+    def __init__(self, first_line, lines):
+        self.first_line = first_line
+        self.lines = lines
+        self.results = []
+        self.cancelled = False
+        self.outdated = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
 
-        elif ord(c) in {0xFEF5, 0xFEF6}:
-            unlinked_text.insert(0, 'آ')
-            unlinked_text.insert(0, 'ل')
+    def run(self):
+        for number, line in enumerate(self.lines, self.first_line):
+            if self.cancelled:
+                return
+            self.results.append(shape_line_map(line, number == 0))
 
-        # Other characters
-        else:
-            unlinked_text.insert(0, c)
+    def is_done(self):
+        return not self.thread.is_alive()
 
-    return unlinked_text
+    # Stop shaping, the result isn't needed anymore
+    def cancel(self):
+        self.cancelled = True
 
 
 # Prepare our text (3D text, text_buffer)
 
 class Text:
-    text_buffer = []
+    text_buffer = None
     current_char_index = 0
+
+    # The lines of the 3D text as they were last written (shaped, one per logical line)
+    # and where their characters are (LineMap, None until we need it)
+    shaped_lines = []
+    line_maps = []
+
+    # Where the visual cursor is (line, column), None when we don't know
+    visual_line = None
+    visual_column = None
+
+    # How the shaped lines are written to the 3D text (a key of output_backends),
+    # and the curve datablock of the text, for the DATABLOCK output
+    output = 'DIFF'
+    curve = None
+
+    # Coalescing: edits change the buffer right away, but the 3D text and the visual cursor
+    # are only updated by flush(), so a burst of keys costs one update.
+    # pending_lines is (first_line, old_count, new_count) like in update_lines
+    coalesce = False
+    pending_lines = None
+    pending_cursor = False
+    flush_scheduled = False
+
+    # Pastes of more than background_size chars are shaped in a worker thread (shaping, a ShapingJob
+    # of the pending lines) and written by flush() once it's done. Edits made meanwhile wait for it,
+    # then it's started again with their lines too: there's only one worker at a time.
+    background_size = 4096
+    shaping = None
+
+    # Whether the text changed since get_saved_state()
+    unsaved = False
     
-    def __init__(self, src: str):
-        self.text_buffer = unlink_text(swap_lines(src))
-        self.current_char_index = len(src)
+    # src is the body of the 3D text. Unlinking it can't always give back what was typed,
+    # so saved_state (from get_saved_state()) is used instead when it was saved for this body.
+    def __init__(self, src: str, curve=None, saved_state=None):
+        self.curve = curve
+        self.shaped_lines = src.split('\n')
+        self.line_maps = [None] * len(self.shaped_lines)
+        
+        text = get_saved_text(src, saved_state)
+        if text is not None:
+            self.text_buffer = GapBuffer(text)
+            self.current_char_index = min(max(saved_state["cursor"], 0), len(self.text_buffer))
+        else:
+            self.text_buffer = GapBuffer(get_logical_text(src))
+            self.current_char_index = len(src)
+            
         self.update_visual_cursor_position()
 
-    def update_text(self):
-        
-        linked_text = link_text(self.text_buffer)
-        linked_text = swap_lines(linked_text)
+    # The logical text and cursor, with the hash of the body they make. None when the body isn't
+    # the text shaped: its lines that weren't edited are only unlinked, which isn't always what
+    # was typed, and saving that would make it the text of the body (see FarsiShaper.reshape_curves)
+    def get_saved_state(self):
+        self.unsaved = False
+        text = self.text_buffer.get_text()
+        body = self.get_body()
+        if shape_text(text) != body:
+            return None
+        return make_saved_state(text, body, self.current_char_index)
+
+    # The body of the 3D text, as we last wrote it
+    def get_body(self):
+        return '\n'.join(self.shaped_lines)
+
+    # Re-shape only the lines touched by an edit:
+    # the old_count lines starting at first_line became new_count lines
+    # (in the worker thread if background, see background_size)
+    def update_lines(self, first_line, old_count, new_count, background=False):
+        self.unsaved = True
         
-        bpy.ops.font.select_all()
-        bpy.ops.font.delete()
-        bpy.ops.font.text_insert(text=linked_text)
+        if self.coalesce or background or self.shaping is not None:
+            self.add_pending_lines(first_line, old_count, new_count)
+            self.pending_cursor = True
+            if self.shaping is not None:
+                self.shaping.outdated = True
+            elif background:
+                self.start_shaping()
+            return
         
+        self.write_changed_lines(first_line, old_count, new_count)
         self.update_visual_cursor_position()
 
+    # Merge an edit with the lines that are waiting for flush()
+    def add_pending_lines(self, first_line, old_count, new_count):
+        if self.pending_lines is None:
+            self.pending_lines = (first_line, old_count, new_count)
+            return
+        
+        # The lines from start to end (before this edit) cover both edits
+        pending_first, pending_old, pending_new = self.pending_lines
+        start = min(pending_first, first_line)
+        end = max(pending_first + pending_new, first_line + old_count)
+        self.pending_lines = (start, end - (pending_new - pending_old) - start, end + (new_count - old_count) - start)
+
+    def has_pending(self):
+        return self.pending_lines is not None or self.pending_cursor
+
+    # Shape the pending lines in a worker thread, instead of the result of an older edit
+    def start_shaping(self):
+        self.cancel_shaping()
+        
+        first_line, old_count, new_count = self.pending_lines
+        lines = [self.text_buffer.get_line(line) for line in range(first_line, first_line + new_count)]
+        self.shaping = ShapingJob(first_line, lines)
+
+    def cancel_shaping(self):
+        if self.shaping is not None:
+            self.shaping.cancel()
+            self.shaping = None
+
+    # Whether the worker thread is still shaping the pending lines (an outdated job is started
+    # again with them when it's done)
+    def is_shaping(self):
+        if self.shaping is None:
+            return False
+        if self.shaping.outdated and self.shaping.is_done():
+            self.start_shaping()
+        return not self.shaping.is_done()
+
+    # Write the pending edits and move the visual cursor
+    # (not before the worker thread shaped them, it's done again later)
+    def flush(self):
+        if self.is_shaping():
+            return
+        
+        if self.shaping is not None:
+            first_line, old_count, new_count = self.pending_lines
+            self.write_shaped_lines(first_line, old_count, self.shaping.results)
+            self.shaping = None
+            self.pending_lines = None
+        elif self.pending_lines is not None:
+            self.write_changed_lines(*self.pending_lines)
+            self.pending_lines = None
+        if self.pending_cursor:
+            self.pending_cursor = False
+            self.place_visual_cursor()
+
+    def write_changed_lines(self, first_line, old_count, new_count):
+        shaped_lines = [shape_line_map(self.text_buffer.get_line(line), line == 0) for line in range(first_line, first_line + new_count)]
+        self.write_shaped_lines(first_line, old_count, shaped_lines)
+
+    # Write lines from shape_line_map(): (shaped, LineMap) for each of them
+    def write_shaped_lines(self, first_line, old_count, shaped_lines):
+        self.line_maps[first_line : first_line + old_count] = [line_map for shaped, line_map in shaped_lines]
+        self.write_lines(first_line, old_count, [shaped for shaped, line_map in shaped_lines])
+
+    # Replace old_count lines of the 3D text (starting at first_line) with new_lines
+    def write_lines(self, first_line, old_count, new_lines):
+        old_lines = self.shaped_lines[first_line : first_line + old_count]
+        
+        if old_lines != new_lines:
+            self.get_output().write(self, first_line, old_lines, new_lines)
+        
+        self.shaped_lines[first_line : first_line + old_count] = new_lines
+
+    # The output backend to write with (see output_backends)
+    def get_output(self):
+        output = output_backends[self.output]
+        if not output.can_write(self):
+            output = output_backends['DIFF']
+        return output
+
     # Add a new character
     def insert_char(self, char):
+        line = self.get_line_number()
+        
         self.text_buffer.insert(self.current_char_index, char)
         self.current_char_index += 1
-        self.update_text()
+        self.update_lines(line, 1, 2 if char == '\n' else 1)
         
 
     # Add a new character
     def insert_text(self, text):
-        self.text_buffer[self.current_char_index : self.current_char_index] = list(text)
+        line = self.get_line_number()
+        
+        self.text_buffer.insert(self.current_char_index, text)
         self.current_char_index += len(text)
-        self.update_text()
+        self.update_lines(line, 1, 1 + text.count('\n'), len(text) > self.background_size)
 
     # Move the cursor (well, our pointer) to the previous char/position
     def move_previous(self):
@@ -468,110 +381,87 @@ class Text:
 
     # Move the cursor/pointer to the start of the current line
     def move_line_start(self):
-        while self.current_char_index > 0:
-            self.current_char_index -= 1
-            if self.text_buffer[self.current_char_index] == '\n':
-                self.current_char_index += 1
-                break
-            
+        self.current_char_index = self.get_line_start()
         self.update_visual_cursor_position()
 
 
     # Move the cursor/pointer to the end of the current line
     def move_line_end(self):
-        while self.current_char_index < len(self.text_buffer):
-            if self.text_buffer[self.current_char_index] == '\n':
-                break
-            self.current_char_index += 1
-            
+        self.current_char_index = self.text_buffer.line_end(self.get_line_number())
         self.update_visual_cursor_position()
 
 
     # Move the cursor/pointer to the previous line
     def move_up(self):
-        line_start = self.get_line_start()
-        line_offset = self.current_char_index - line_start
-        previous_line_end = line_start - 2
-        previous_line_start = self.get_line_start(previous_line_end)
-        previous_line_size = previous_line_end - previous_line_start
-        new_index = previous_line_start + min(line_offset, previous_line_size + 1)
+        line = self.get_line_number()
+        if line == 0:
+            return
+        
+        line_offset = self.current_char_index - self.text_buffer.line_start(line)
+        previous_line_start = self.text_buffer.line_start(line - 1)
+        previous_line_size = self.text_buffer.line_end(line - 1) - previous_line_start
         
-        if self.is_valid_char_index(new_index):
-            self.current_char_index = new_index
-            self.update_visual_cursor_position()
+        self.current_char_index = previous_line_start + min(line_offset, previous_line_size)
+        self.update_visual_cursor_position()
 
 
     # Move the cursor/pointer to the next line
     def move_down(self):
-        
-        new_line_size = 0
-        
-        line_start = self.get_line_start()
-        line_offset = self.current_char_index - line_start
-        
-        new_index = self.get_next_line_start()
-        
-        if new_index == -1:
+        line = self.get_line_number()
+        if line + 1 == self.text_buffer.count_lines():
             return
         
-        for i in range(line_offset):
-            
-            if not self.is_valid_char_index(new_index):
-                break
-            
-            if self.text_buffer[new_index] == '\n':
-                break
-            
-            new_index += 1
-            
-        if self.is_valid_char_index(new_index) or new_index == len(self.text_buffer):
-            self.current_char_index = new_index
-            self.update_visual_cursor_position()
+        line_offset = self.current_char_index - self.text_buffer.line_start(line)
+        next_line_start = self.text_buffer.line_start(line + 1)
+        next_line_size = self.text_buffer.line_end(line + 1) - next_line_start
+        
+        self.current_char_index = next_line_start + min(line_offset, next_line_size)
+        self.update_visual_cursor_position()
 
 
     # Delete the previous character
     def delete_previous(self):
         if self.current_char_index > 0:
-            self.text_buffer.pop(self.current_char_index - 1)
+            line = self.get_line_number()
+            
             self.current_char_index -= 1
-            self.update_text()
+            
+            # Deleting a line break joins the line with the previous one
+            if self.text_buffer.delete(self.current_char_index) == '\n':
+                self.update_lines(line - 1, 2, 1)
+            else:
+                self.update_lines(line, 1, 1)
 
 
     # Delete the next character
     def delete_next(self):
         if self.is_valid_char_index(self.current_char_index):
-            del self.text_buffer[self.current_char_index]
+            line = self.get_line_number()
             
-            self.update_text()
+            # Deleting a line break joins the line with the next one
+            if self.text_buffer.delete(self.current_char_index) == '\n':
+                self.update_lines(line, 2, 1)
+            else:
+                self.update_lines(line, 1, 1)
 
 
     #
 
     def get_line_start(self, index=-1):
-        line_start = self.current_char_index if index == - 1 else index
-        while line_start > 0:
-            line_start -= 1
-            if self.text_buffer[line_start] == '\n':
-                line_start += 1
-                break
-            
-        return line_start
+        return self.text_buffer.line_start(self.get_line_number(index))
 
 
-    #
+    # Number of the line of index (of the cursor by default)
+    def get_line_number(self, index=-1):
+        return self.text_buffer.line_of(self.current_char_index if index == -1 else index)
+
+
+    # Where the characters of a line are in the 3D text
+    def get_line_map(self, line):
+        if self.line_maps[line] is None:
+            _, self.line_maps[line] = shape_line_map(self.text_buffer.get_line(line), line == 0)
+        return self.line_maps[line]
 
-    def get_next_line_start(self):
-        next_line_start = self.current_char_index
-        while next_line_start < len(self.text_buffer):
-            if self.text_buffer[next_line_start] == '\n':
-                next_line_start += 1
-                break
-            
-            next_line_start += 1
-            if next_line_start == len(self.text_buffer):
-                return -1
-            
-        return next_line_start
 
     def is_valid_char_index(self, index):
         if len(self.text_buffer) > 0 and index >= 0 and index < len(self.text_buffer):
@@ -581,27 +471,187 @@ class Text:
 
     # Make the visual cursor follow our pointer
     def update_visual_cursor_position(self):
-        # Move visual cursor to the begining of the text
-        for i in range(len(self.text_buffer)):
-            bpy.ops.font.move(type='PREVIOUS_CHARACTER')
+        if self.coalesce or self.shaping is not None:
+            self.pending_cursor = True
+        else:
+            self.place_visual_cursor()
+
+    def place_visual_cursor(self):
+        if not self.get_output().moves_cursor:
+            return
+        
+        line = self.get_line_number()
+        line_map = self.get_line_map(line)
+        line_offset = self.current_char_index - self.text_buffer.line_start(line)
+        
+        self.move_visual_cursor(line, line_map.cursor_column(line_offset))
+
+
+    # Move the visual cursor to (line, column) of the 3D text, from where it was.
+    # This only needs one move per line and the shortest way to the column in the line.
+    # With select, the selection is extended to there.
+    def move_visual_cursor(self, line, column, select=False):
+        move = bpy.ops.font.move_select if select else bpy.ops.font.move
+        
+        if self.visual_line is None:
+            # We don't know where it is: selecting everything puts it at the end of the text
+            bpy.ops.font.select_all()
+            bpy.ops.font.move(type='LINE_END')
+            self.visual_line = len(self.shaped_lines) - 1
+            self.visual_column = len(self.shaped_lines[-1])
+        
+        # Moving to another line keeps the x position, not the column
+        while self.visual_line > line:
+            move(type='PREVIOUS_LINE')
+            self.visual_line -= 1
+            self.visual_column = None
+        while self.visual_line < line:
+            move(type='NEXT_LINE')
+            self.visual_line += 1
+            self.visual_column = None
+        
+        line_length = len(self.shaped_lines[line])
+        
+        if self.visual_column is None or abs(column - self.visual_column) > 1 + min(column, line_length - column):
+            if column <= line_length - column:
+                move(type='LINE_BEGIN')
+                self.visual_column = 0
+            else:
+                move(type='LINE_END')
+                self.visual_column = line_length
         
-        current_line_start = self.get_line_start()
-        for i in range(current_line_start):
-            if self.text_buffer[i] == '\n':
-                bpy.ops.font.move(type='NEXT_LINE')
+        for i in range(self.visual_column, column):
+            move(type='NEXT_CHARACTER')
+        for i in range(column, self.visual_column):
+            move(type='PREVIOUS_CHARACTER')
+        
+        self.visual_column = column
+
+
+    # Forget where the visual cursor is (something else moved it),
+    # it's put back at our pointer the next time we move it
+    def forget_visual_cursor(self):
+        self.visual_line = None
+        self.visual_column = None
+
+
+
+# Output backends: how Text writes its shaped lines into the 3D text.
+# Every backend gets the lines that changed and leaves Text.visual_line/visual_column where
+# the visual cursor ends up. They are chosen at runtime with Text.output.
+
+# The original path: select everything, delete it and insert the whole body
+class OperatorOutput:
+    moves_cursor = True
+
+    def can_write(self, text):
+        return True
+
+    def write(self, text, first_line, old_lines, new_lines):
+        body = get_new_body(text, first_line, old_lines, new_lines)
         
-        # NOTE: we can do this in another way, without moving the cursor to the and of the line and then bring it back
-        # we can just count the length of the current line and move the cursor forward:
-        # (line_length - current_line_offset(= self.current_char_index - line_start)) times
+        bpy.ops.font.select_all()
+        bpy.ops.font.delete()
+        bpy.ops.font.text_insert(text=body)
         
-        bpy.ops.font.move(type='LINE_END')
+        text.visual_line, text.visual_column = get_text_position(body, len(body))
+
+
+# The whole body at once: inserting text replaces the selection, so there's no need to delete
+class BodyOutput(OperatorOutput):
+
+    def write(self, text, first_line, old_lines, new_lines):
+        body = get_new_body(text, first_line, old_lines, new_lines)
         
-        for i in range(current_line_start, self.current_char_index):
+        bpy.ops.font.select_all()
+        if body:
+            bpy.ops.font.text_insert(text=body)
+        else:
+            bpy.ops.font.delete(type='PREVIOUS_OR_SELECTION')
             
-            # Do not count "Lem-Alef" as two letters
-            if self.text_buffer[i] in {'ا', 'أ', 'إ', 'آ'}:
-                if i > 0 and self.text_buffer[i - 1] == 'ل':
-                    continue
-                
-            bpy.ops.font.move(type='PREVIOUS_CHARACTER')
+        text.visual_line, text.visual_column = get_text_position(body, len(body))
+
+
+# Select the lines that changed and insert their new text
+class LineOutput(OperatorOutput):
+
+    def write(self, text, first_line, old_lines, new_lines):
+        old_text = '\n'.join(old_lines)
+        new_text = '\n'.join(new_lines)
+        start, old_end, new_end = self.get_changed_span(old_text, new_text)
+
+        # Select what changed
+        line, column = get_text_position(old_text, start)
+        text.move_visual_cursor(first_line + line, column)
+        
+        if old_end > start:
+            line, column = get_text_position(old_text, old_end)
+            text.move_visual_cursor(first_line + line, column, select=True)
+
+        # Inserting text replaces the selection
+        if new_end > start:
+            bpy.ops.font.text_insert(text=new_text[start:new_end])
+            line, column = get_text_position(new_text, new_end)
+        else:
+            bpy.ops.font.delete(type='PREVIOUS_OR_SELECTION')
+            line, column = get_text_position(new_text, start)
+            
+        text.visual_line = first_line + line
+        text.visual_column = column
+
+    # What to replace: old_text[start:old_end] becomes new_text[start:new_end]
+    def get_changed_span(self, old_text, new_text):
+        return 0, len(old_text), len(new_text)
+
+
+# Select only the characters that changed (typing a letter usually changes one or two glyphs)
+class DiffOutput(LineOutput):
+
+    def get_changed_span(self, old_text, new_text):
+        size = min(len(old_text), len(new_text))
+        
+        start = 0
+        while start < size and old_text[start] == new_text[start]:
+            start += 1
+            
+        end = 0
+        while end < size - start and old_text[-1 - end] == new_text[-1 - end]:
+            end += 1
+            
+        return start, len(old_text) - end, len(new_text) - end
+
+
+# Write the body of the curve datablock directly, without any operator.
+# This only works when the text isn't in edit mode (Text.curve has to be set), otherwise Text
+# falls back to DIFF. The add-on only edits texts in edit mode, where the body is only read when
+# leaving it, so it isn't one of its preferences: it's for scripts that edit a curve with Text.
+class DatablockOutput:
+    moves_cursor = False
+
+    def can_write(self, text):
+        return text.curve is not None and not text.curve.is_editmode
+
+    def write(self, text, first_line, old_lines, new_lines):
+        text.curve.body = get_new_body(text, first_line, old_lines, new_lines)
+
+
+output_backends = {
+    'DIFF': DiffOutput(),
+    'LINES': LineOutput(),
+    'BODY': BodyOutput(),
+    'OPERATORS': OperatorOutput(),
+    'DATABLOCK': DatablockOutput(),
+}
+
+
+# The body of a text once old_lines (starting at first_line) are replaced with new_lines
+def get_new_body(text, first_line, old_lines, new_lines):
+    lines = text.shaped_lines[:first_line] + new_lines + text.shaped_lines[first_line + len(old_lines):]
+    return '\n'.join(lines)
+
 
+# (line, column) of index in a text
+def get_text_position(text, index):
+    line = text.count('\n', 0, index)
+    column = index - (text.rfind('\n', 0, index) + 1)
+    return line, column
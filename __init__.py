@@ -11,126 +11,414 @@ bl_info = {
 }
 
 import bpy
-from bpy.types import Operator, Context, Event
+from bpy.types import Operator, AddonPreferences, Context, Event
+from bpy.props import BoolProperty, EnumProperty
 from . import FarsiText as Fa
+from . import FarsiImport
+from . import FarsiAnimation
+from . import FarsiProfiler
 
 
-# Keyboard Handler
-class __OT_FarsiTextMode(Operator):
+class FarsiTextPreferences(AddonPreferences):
+    bl_idname = __name__
 
-    bl_idname = "view3d.arabic_text_mode"
-    bl_label = "Write Farsi Text"
-    my_map: dict[int, Fa.Text] = {}
-    
-    def modal(self, context: Context, event: Event):
-        
-        # Use this handler only when a 3DText object is selected and being edited
-        
-        if context.object is None or context.object.type != 'FONT' or context.object.mode != 'EDIT':
-        
-            return {'PASS_THROUGH'}
-        
-        if id(context.object) not in self.my_map:
-            self.my_map[id(context.object)] = Fa.Text(context.object.data.body)
-        fa = self.my_map[id(context.object)]
-        
-        if event.type == 'BACK_SPACE':
-            if event.value == 'PRESS':
-                fa.delete_previous()
-            return {'RUNNING_MODAL'}
-        
-        elif event.type == 'DEL':
-            if event.value == 'PRESS':
-                fa.delete_next()
-            return {'RUNNING_MODAL'}
-        
-        elif event.type == 'HOME':
-            if event.value == 'PRESS':
-                fa.move_line_start()
-            return {'RUNNING_MODAL'}
-        
-        elif event.type == 'END':
-            if event.value == 'PRESS':
-                fa.move_line_end()
-            return {'RUNNING_MODAL'}
-        
-        elif event.type == 'RIGHT_ARROW':
-            if event.value == 'PRESS':
-                fa.move_previous()
-            return {'RUNNING_MODAL'}
+    coalesce_typing: BoolProperty(
+        name="Coalesce Typing",
+        description="Apply key presses right away but update the 3D text once per redraw (faster key repeat and typing)",
+        default=False,
+    )
+
+    output: EnumProperty(
+        name="Output",
+        description="How the shaped text is written to the 3D text",
+        items=[
+            ('DIFF', "Changed Characters", "Replace only the characters that changed"),
+            ('LINES', "Changed Lines", "Replace the lines that changed"),
+            ('BODY', "Whole Text", "Replace the whole text"),
+            ('OPERATORS', "Legacy", "Delete and insert the whole text (the original way)"),
+        ],
+        default='DIFF',
+    )
+
+    def draw(self, context: Context):
+        self.layout.prop(self, "coalesce_typing")
+        self.layout.prop(self, "output")
+
+def get_preferences(context: Context) -> FarsiTextPreferences:
+    return context.preferences.addons[__name__].preferences
+
+
+# Editor state (Fa.Text) of the 3D texts we edit.
+# Texts are keyed by the session_uid of their curve datablock (it isn't reused like id()),
+# and when the body may have been changed outside the add-on (undo, scripts, leaving edit mode)
+# the next use compares it with what we last wrote, so a text is only rebuilt when it changed.
+class TextRegistry:
+
+    def __init__(self):
+        self.texts: dict[int, Fa.Text] = {}
+        self.unchecked: set[int] = set()
+        self.unsynced: set[int] = set()
+
+    def get(self, obj) -> Fa.Text:
+        data = obj.data
+        key = data.session_uid
+        fa = self.texts.get(key)
+
+        if fa is not None and key in self.unchecked:
+            if key in self.unsynced:
+                # Undo in edit mode changes the edited text, the body only follows when leaving edit mode
+                bpy.ops.object.editmode_toggle()
+                bpy.ops.object.editmode_toggle()
+                fa.forget_visual_cursor()
             
-        elif event.type == 'LEFT_ARROW':
-            if event.value == 'PRESS':
-                fa.move_next()
-            return {'RUNNING_MODAL'}
-        
-        elif event.type == 'UP_ARROW':
-            if event.value == 'PRESS':
-                fa.move_up()
-            return {'RUNNING_MODAL'}
-
-        elif event.type == 'DOWN_ARROW':
-            if event.value == 'PRESS':
-                fa.move_down()
-            return {'RUNNING_MODAL'}
-
-        elif event.type == 'RET':
-            if event.value == 'PRESS':
-                fa.insert_char('\n')
-            return {'RUNNING_MODAL'}
-                   
-        elif event.type == 'TAB':
+            # In edit mode the body is only updated when leaving it (or synced above): until then it's
+            # older than the edited text, which is kept
+            if (key in self.unsynced or not data.is_editmode) and data.body != fa.get_body():
+                fa = None
+
+        self.unchecked.discard(key)
+        self.unsynced.discard(key)
+
+        if fa is None:
+            self.evict()
+            fa = Fa.Text(data.body, data, data.get(Fa.state_property))
+            self.texts[key] = fa
+
+        return fa
+
+    # Whether fa is still the text of obj (it may have been rebuilt since)
+    def is_current(self, obj, fa: Fa.Text) -> bool:
+        return self.texts.get(obj.data.session_uid) is fa
+
+    # Keep the logical text and cursor of the texts that changed on their curve,
+    # where they are loaded from the next time (after loading the file or undo)
+    def save_states(self):
+        for curve in bpy.data.curves:
+            fa = self.texts.get(curve.session_uid)
+            if fa is not None and fa.unsaved and not fa.has_pending():
+                saved_state = fa.get_saved_state()
+                if saved_state is not None:
+                    curve[Fa.state_property] = saved_state
+
+    # Check the texts against their body the next time they are used
+    # (sync: the body has to be updated from edit mode first)
+    def invalidate(self, sync=False):
+        self.unchecked.update(self.texts)
+        if sync:
+            self.unsynced.update(self.texts)
+
+    # Forget the texts of deleted datablocks
+    def evict(self):
+        alive = {curve.session_uid for curve in bpy.data.curves}
+        for key in list(self.texts):
+            if key not in alive:
+                del self.texts[key]
+                self.unchecked.discard(key)
+                self.unsynced.discard(key)
+
+    def clear(self):
+        self.texts.clear()
+        self.unchecked.clear()
+        self.unsynced.clear()
+
+texts = TextRegistry()
+
+
+# What the editing keys do (see keymap_items)
+text_actions = {
+    'DELETE_PREVIOUS': lambda fa, context: fa.delete_previous(),
+    'DELETE_NEXT': lambda fa, context: fa.delete_next(),
+    'NEW_LINE': lambda fa, context: fa.insert_char('\n'),
+    'PASTE': lambda fa, context: fa.insert_text(context.window_manager.clipboard),
+    'LINE_START': lambda fa, context: fa.move_line_start(),
+    'LINE_END': lambda fa, context: fa.move_line_end(),
+    'PREVIOUS': lambda fa, context: fa.move_previous(),
+    'NEXT': lambda fa, context: fa.move_next(),
+    'UP': lambda fa, context: fa.move_up(),
+    'DOWN': lambda fa, context: fa.move_down(),
+}
+
+# Actions that only move the cursor (they don't need an undo step)
+move_actions = ('LINE_START', 'LINE_END', 'PREVIOUS', 'NEXT', 'UP', 'DOWN')
+
+
+def is_editing_text(context: Context):
+    obj = context.object
+    return obj is not None and obj.type == 'FONT' and obj.mode == 'EDIT'
+
+def get_text(context: Context) -> Fa.Text:
+    fa = texts.get(context.object)
+    preferences = get_preferences(context)
+    fa.coalesce = preferences.coalesce_typing
+    fa.output = preferences.output
+    return fa
+
+def text_updated(context: Context, fa: Fa.Text):
+    if fa.has_pending():
+        schedule_flush(context, fa)
+
+
+class __OT_FarsiTextEdit(Operator):
+    """Edit Farsi/Arabic text"""
+
+    bl_idname = "font.farsi_text_edit"
+    bl_label = "Edit Farsi Text"
+    bl_options = {'UNDO'}
+
+    action: EnumProperty(items=[(action, action.replace('_', ' ').title(), "") for action in text_actions if action not in move_actions])
+
+    @classmethod
+    def poll(cls, context: Context):
+        return is_editing_text(context)
+
+    def execute(self, context: Context):
+        with FarsiProfiler.recorder.record(self.action):
+            fa = get_text(context)
+            text_actions[self.action](fa, context)
+            text_updated(context, fa)
+        return {'FINISHED'}
+
+
+class __OT_FarsiTextMove(Operator):
+    """Move the cursor in Farsi/Arabic text"""
+
+    bl_idname = "font.farsi_text_move"
+    bl_label = "Move in Farsi Text"
+
+    action: EnumProperty(items=[(action, action.replace('_', ' ').title(), "") for action in move_actions])
+
+    @classmethod
+    def poll(cls, context: Context):
+        return is_editing_text(context)
+
+    def execute(self, context: Context):
+        with FarsiProfiler.recorder.record(self.action):
+            fa = get_text(context)
+            text_actions[self.action](fa, context)
+            text_updated(context, fa)
+        return {'FINISHED'}
+
+
+class __OT_FarsiTextInsert(Operator):
+    """Insert Farsi/Arabic text"""
+
+    bl_idname = "font.farsi_text_insert"
+    bl_label = "Insert Farsi Text"
+    bl_options = {'UNDO'}
+
+    @classmethod
+    def poll(cls, context: Context):
+        return is_editing_text(context)
+
+    def invoke(self, context: Context, event: Event):
+        if not event.unicode:
             return {'PASS_THROUGH'}
-            
-        elif event.unicode:
-            if event.value == 'PRESS':
-                fa.insert_char(event.unicode)
-            return {'RUNNING_MODAL'}
-        
-        elif event.type == 'V' and event.ctrl:
-            if event.value == 'PRESS':
-                pasted_text = bpy.context.window_manager.clipboard
-                fa.insert_text(pasted_text)
-            return {'RUNNING_MODAL'}
         
+        with FarsiProfiler.recorder.record('INSERT'):
+            fa = get_text(context)
+            fa.insert_char(event.unicode)
+            text_updated(context, fa)
+        return {'FINISHED'}
+
+
+class __OT_FarsiTextClick(Operator):
+    """Let the add-on know the cursor may have been moved by Blender (mouse, page keys)"""
+
+    bl_idname = "font.farsi_text_click"
+    bl_label = "Farsi Text Click"
+    bl_options = {'INTERNAL'}
+
+    @classmethod
+    def poll(cls, context: Context):
+        return is_editing_text(context)
+
+    def invoke(self, context: Context, event: Event):
+        get_text(context).forget_visual_cursor()
         return {'PASS_THROUGH'}
-     
-    #
+
+
+class __OT_FarsiTextReshape(Operator):
+    """Shape the Farsi/Arabic text of many text objects again, without editing them"""
+
+    bl_idname = "object.farsi_text_reshape"
+    bl_label = "Reshape Farsi Texts"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    scope: EnumProperty(
+        name="Texts",
+        items=[
+            ('SELECTED', "Selected", "The selected text objects"),
+            ('SCENE', "Scene", "All the text objects of the scene"),
+        ],
+        default='SELECTED',
+    )
+
+    def execute(self, context: Context):
+        objects = context.selected_objects if self.scope == 'SELECTED' else context.scene.objects
         
-    def invoke(self, context: Context, event: Event):
+        # Every curve once, not the ones in edit mode (their body isn't up to date)
+        curves = {obj.data.session_uid: obj.data for obj in objects if obj.type == 'FONT' and not obj.data.is_editmode}
+        curves = list(curves.values())
         
-        if context.area.type == 'VIEW_3D':
-            self.key = ""
-            context.window_manager.modal_handler_add(self)
-            if context.object is not None and context.object.type == 'FONT' and context.object.mode == 'EDIT':
-                # update text data (i don't know a better way to do this)
-                bpy.ops.object.editmode_toggle()
-                bpy.ops.object.editmode_toggle()
-            return {'RUNNING_MODAL'}
+        # From their saved logical text, or the lines that come back as they were (see Fa.reshape_curves)
+        changed = Fa.reshape_curves(curves)
+        
+        # One update for all of them
+        if changed:
+            context.view_layer.update()
+            texts.invalidate()
+        
+        self.report({'INFO'}, f"Reshaped {changed} of {len(curves)} texts")
+        return {'FINISHED'}
+
+
+# Keys of the "Font" keymap (text edit mode): (event type, ctrl, operator, action)
+# Add-on keymap items are used before the default ones, in reverse order. Keys without ctrl
+# are taken with any modifiers, else Blender's operators (select, move by word, ...) would edit
+# the body or move the cursor behind our back. The click operator passes them through.
+keymap_items = [
+    ('TEXTINPUT', False, __OT_FarsiTextInsert, None),
+    ('LEFTMOUSE', False, __OT_FarsiTextClick, None),
+    ('BACK_SPACE', False, __OT_FarsiTextEdit, 'DELETE_PREVIOUS'),
+    ('DEL', False, __OT_FarsiTextEdit, 'DELETE_NEXT'),
+    ('RET', False, __OT_FarsiTextEdit, 'NEW_LINE'),
+    ('V', True, __OT_FarsiTextEdit, 'PASTE'),
+    ('HOME', False, __OT_FarsiTextMove, 'LINE_START'),
+    ('END', False, __OT_FarsiTextMove, 'LINE_END'),
+    ('RIGHT_ARROW', False, __OT_FarsiTextMove, 'PREVIOUS'),
+    ('LEFT_ARROW', False, __OT_FarsiTextMove, 'NEXT'),
+    ('UP_ARROW', False, __OT_FarsiTextMove, 'UP'),
+    ('DOWN_ARROW', False, __OT_FarsiTextMove, 'DOWN'),
+    ('PAGE_UP', False, __OT_FarsiTextClick, None),
+    ('PAGE_DOWN', False, __OT_FarsiTextClick, None),
+]
+
+addon_keymaps = []
+
+def register_keymaps():
+    keyconfig = bpy.context.window_manager.keyconfigs.addon
+    if keyconfig is None:  # Background mode
+        return
+    
+    keymap = keyconfig.keymaps.new(name="Font", space_type='EMPTY')
+    for event_type, ctrl, operator, action in keymap_items:
+        if event_type == 'TEXTINPUT':
+            item = keymap.keymap_items.new(operator.bl_idname, event_type, 'ANY', any=True)
+        elif ctrl:
+            item = keymap.keymap_items.new(operator.bl_idname, event_type, 'PRESS', ctrl=True)
         else:
-            return {'CANCELLED'}
+            item = keymap.keymap_items.new(operator.bl_idname, event_type, 'PRESS', any=True)
+        if action is not None:
+            item.properties.action = action
+        addon_keymaps.append((keymap, item))
+
+def unregister_keymaps():
+    for keymap, item in addon_keymaps:
+        keymap.keymap_items.remove(item)
+    addon_keymaps.clear()
+
+
+# Update the 3D text once, after the events that are waiting were handled
+# (and after the edits that are shaped in a worker thread are done)
+def schedule_flush(context: Context, fa: Fa.Text):
+    if fa.flush_scheduled:
+        return
+    
+    fa.flush_scheduled = True
+    override = {'window': context.window, 'area': context.area, 'region': context.region}
+    
+    def flush():
+        if fa.is_shaping():
+            return 0.05  # Check again when the worker thread may be done
+        
+        fa.flush_scheduled = False
+        with bpy.context.temp_override(**override), FarsiProfiler.recorder.record('FLUSH'):
+            if is_editing_text(bpy.context) and texts.is_current(bpy.context.object, fa):
+                fa.flush()
+        return None
+    
+    bpy.app.timers.register(flush, first_interval=0)
 
 from bpy.app.handlers import persistent
 
+# Owner of our message bus subscriptions
+msgbus_owner = object()
+
+def subscribe_changes():
+    # Mode changes (leaving/entering edit mode) and scripts writing the body
+    bpy.msgbus.subscribe_rna(key=(bpy.types.Object, "mode"), owner=msgbus_owner, args=(), notify=mode_changed)
+    bpy.msgbus.subscribe_rna(key=(bpy.types.TextCurve, "body"), owner=msgbus_owner, args=(), notify=texts.invalidate)
+
+def mode_changed():
+    texts.save_states()
+    texts.invalidate()
+
+@persistent
+def save_handler(dummy):
+    texts.save_states()
+
+@persistent
+def undo_handler(dummy):
+    texts.evict()
+    texts.invalidate(sync=True)
+
 @persistent
 def load_handler(dummy):
-    for area in bpy.context.screen.areas:
-        if area.type == "VIEW_3D":
-            with bpy.context.temp_override(area = area):
-                bpy.ops.view3d.arabic_text_mode('INVOKE_DEFAULT')
-                break
+    # The subscriptions are removed and the datablocks replaced when a file is loaded
+    texts.clear()
+    subscribe_changes()
+
+classes = (
+    FarsiTextPreferences,
+    __OT_FarsiTextEdit,
+    __OT_FarsiTextMove,
+    __OT_FarsiTextInsert,
+    __OT_FarsiTextClick,
+    __OT_FarsiTextReshape,
+)
 
 def register():
-    bpy.utils.register_class(__OT_FarsiTextMode)
+    for cls in classes:
+        bpy.utils.register_class(cls)
+
+    FarsiImport.register()
+    FarsiAnimation.register()
+    FarsiProfiler.register()
+    register_keymaps()
 
     if load_handler not in bpy.app.handlers.load_post:
         bpy.app.handlers.load_post.append(load_handler)
+
+    if save_handler not in bpy.app.handlers.save_pre:
+        bpy.app.handlers.save_pre.append(save_handler)
+
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        if undo_handler not in handlers:
+            handlers.append(undo_handler)
+
+    subscribe_changes()
     
 def unregister():
-    bpy.utils.unregister_class(__OT_FarsiTextMode)
+    unregister_keymaps()
+    FarsiImport.unregister()
+    FarsiAnimation.unregister()
+    FarsiProfiler.unregister()
+
+    for cls in reversed(classes):
+        bpy.utils.unregister_class(cls)
     
     if load_handler in bpy.app.handlers.load_post:
         bpy.app.handlers.load_post.remove(load_handler)
 
+    if save_handler in bpy.app.handlers.save_pre:
+        bpy.app.handlers.save_pre.remove(save_handler)
+
+    for handlers in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        if undo_handler in handlers:
+            handlers.remove(undo_handler)
+
+    bpy.msgbus.clear_by_owner(msgbus_owner)
+    texts.clear()
+
 if __name__ == "__main__":
     register()
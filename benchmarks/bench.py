@@ -0,0 +1,255 @@
+# Benchmarks of the shaping functions and of the editor (Text), outside Blender.
+#
+#   python benchmarks/bench.py                              print the results
+#   python benchmarks/bench.py --save benchmarks/baseline.json
+#   python benchmarks/bench.py --compare benchmarks/baseline.json [--tolerance 1.0]
+#
+# Texts go from 10 to 100k chars, on one line or on lines of about 60 chars, and link_text is also
+# timed on single lines that mix scripts (mixed_lines). The editor runs on
+# bpy_stub, which counts the bpy.ops.font calls: "ops" is the number of calls per keystroke.
+# With --compare, the exit code is 1 when something is slower than the baseline by more than
+# the tolerance, or makes more operator calls. Times are compared relative to a calibration loop
+# timed in both runs, so a baseline from a faster or busier machine can still be used. Times under
+# 50 us vary too much to be compared, and so can the others on a busy machine: the default
+# tolerance (1.0) only catches a doubling.
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import types
+
+import bpy_stub
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sizes = (10, 100, 1000, 10000, 100000)
+layouts = ('line', 'lines')
+keystrokes = 100     # Per run, fewer on big texts
+
+# Single lines mixing scripts, where glyphs go all over the line (not only at its visual start)
+mixed_lines = {
+    'tatweel': lambda size, generator: ('ـa 1' * size)[:size],
+    'latin': lambda size, generator: ('hello world 123, ' * size)[:size],
+    'random': lambda size, generator: ''.join(generator.choice('ـ1a .,:-9bس()،') for _ in range(size)),
+}
+
+words = ['سلام', 'دنیا', 'کتاب', 'لاله', 'پنجره', 'گل', 'آسمان', 'ژاله', 'ماه', 'شب', 'خانه',
+         'بلند', 'یک', 'است', 'و', 'از', 'به', '۱۴۰۲', '2024', 'Blender', 'text', '،', '؟', '.', '(', ')']
+
+
+# The add-on modules, imported as a package (its __init__ needs Blender, so it isn't run)
+def import_addon():
+    bpy_stub.install()
+    package = types.ModuleType('farsi_text')
+    package.__path__ = [root]
+    sys.modules['farsi_text'] = package
+    return importlib.import_module('farsi_text.FarsiShaper'), importlib.import_module('farsi_text.FarsiText')
+
+
+def make_text(size, layout, seed=0):
+    generator = random.Random(seed)
+    text = []
+    length = 0
+    line_length = 0
+    while length < size:
+        word = generator.choice(words)
+        if layout == 'lines' and line_length > 60:
+            text.append('\n')
+            line_length = 0
+        elif text:
+            text.append(' ')
+        text.append(word)
+        length += len(word) + 1
+        line_length += len(word) + 1
+    return ''.join(text)[:size]
+
+
+# Seconds per call of function (the best of a few runs of number calls)
+def measure(function, number=None, repeat=3):
+    if number is None:
+        number = 1
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        number = max(1, min(1000, int(0.05 / max(elapsed, 1e-9))))
+
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+# A fixed amount of plain Python work, to compare times measured on different machines.
+# It's the median of many runs: a busy moment while it runs would make every time of the
+# run look faster or slower than it is.
+def calibrate(repeat=25):
+    def work():
+        text = []
+        for i in range(20000):
+            text.append(chr(0x0600 + i % 64))
+        return ''.join(reversed(text)).split('\u0620')
+    return statistics.median(measure(work, number=5, repeat=1) for _ in range(repeat))
+
+
+def bench_shaping(shaper, results):
+    for layout in layouts:
+        for size in sizes:
+            text = make_text(size, layout)
+            linked = shaper.link_text(text)
+
+            results[f"link_text/{layout}/{size}"] = {"seconds": measure(lambda: shaper.link_text(text))}
+            results[f"unlink_text/{layout}/{size}"] = {"seconds": measure(lambda: shaper.unlink_text(linked))}
+            results[f"swap_lines/{layout}/{size}"] = {"seconds": measure(lambda: shaper.swap_lines(linked))}
+
+            def shape_text():
+                shaper.line_cache.clear()
+                shaper.shape_text(text)
+            results[f"shape_text/{layout}/{size}"] = {"seconds": measure(shape_text)}
+
+    for name, make_line in mixed_lines.items():
+        for size in sizes[2:]:
+            line = make_line(size, random.Random(0))
+            results[f"link_text/{name}/{size}"] = {"seconds": measure(lambda: shaper.link_text(line))}
+
+
+# Time and operator calls per keystroke of an editing action, on a text of size chars
+# (the best of a few runs). Edits shaped in a worker thread are waited for and written,
+# like the add-on's timer does.
+def bench_keystrokes(fa_module, shaper, size, layout, prepare, action, repeat=3):
+    font = bpy_stub.font
+    text = make_text(size, layout)
+    body = shaper.shape_text(text)
+    # With its saved state, like the add-on opens a text it edited: unlinking the Latin words
+    # and digits of body reverses them, and the first keystroke would rewrite their whole line
+    saved_state = shaper.make_saved_state(text, body)
+    count = max(20, min(keystrokes, 2000000 // size))
+    best = float('inf')
+
+    for _ in range(repeat):
+        shaper.line_cache.clear()
+        font.reset(body)
+        fa = fa_module.Text(body, None, saved_state)
+        prepare(fa)
+        font.calls.clear()
+
+        start = time.perf_counter()
+        for i in range(count):
+            action(fa, i)
+            if fa.has_pending():
+                while fa.is_shaping():
+                    time.sleep(0)
+                fa.flush()
+        best = min(best, (time.perf_counter() - start) / count)
+
+        assert font.text == fa.get_body()
+
+    return {"seconds": best, "ops": font.count() / count, "calls": dict(font.calls)}
+
+
+def bench_editor(fa_module, shaper, results):
+    def to_middle(fa):
+        fa.current_char_index = len(fa.text_buffer) // 2
+        fa.update_visual_cursor_position()
+
+    def to_end(fa):
+        pass
+
+    typed = 'سلام دنیا کتاب '
+    actions = {
+        'insert_char/end': (to_end, lambda fa, i: fa.insert_char(typed[i % len(typed)])),
+        'insert_char/middle': (to_middle, lambda fa, i: fa.insert_char(typed[i % len(typed)])),
+        'delete_previous/middle': (to_middle, lambda fa, i: fa.delete_previous()),
+        'move_previous/middle': (to_middle, lambda fa, i: fa.move_previous()),
+        'move_up_down/middle': (to_middle, lambda fa, i: fa.move_up() if i % 2 else fa.move_down()),
+    }
+
+    for layout in layouts:
+        for size in sizes:
+            body = make_text(size, layout)
+            results[f"Text/{layout}/{size}"] = {"seconds": measure(lambda: fa_module.Text(shaper.shape_text(body)), repeat=1)}
+
+            for name, (prepare, action) in actions.items():
+                results[f"{name}/{layout}/{size}"] = bench_keystrokes(fa_module, shaper, size, layout, prepare, action)
+
+
+def print_results(results, baseline=None, speed=1.0):
+    print(f"{'benchmark':40} {'time':>12} {'ops/key':>8}" + ("  vs baseline" if baseline else ""))
+    for name, result in results.items():
+        line = f"{name:40} {format_time(result['seconds']):>12}"
+        line += f" {result['ops']:>8.2f}" if "ops" in result else " " * 9
+        if baseline and name in baseline:
+            line += f"  {result['seconds'] / (baseline[name]['seconds'] * speed):>6.2f}x"
+        print(line)
+
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.1f} us"
+    if seconds < 1:
+        return f"{seconds * 1e3:.2f} ms"
+    return f"{seconds:.2f} s"
+
+
+# Names of the results that got worse than the baseline
+# (speed is how much slower this machine is than the baseline's, from the calibration)
+def find_regressions(results, baseline, tolerance, speed=1.0):
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        if result["seconds"] > max(old["seconds"] * speed, 50e-6) * (1 + tolerance):
+            regressions.append(f"{name}: {format_time(old['seconds'])} -> {format_time(result['seconds'])}")
+        if "ops" in old and result["ops"] > old["ops"]:
+            regressions.append(f"{name}: {old['ops']:.2f} -> {result['ops']:.2f} operator calls per keystroke")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Farsi text shaping and editor")
+    parser.add_argument("--save", metavar="FILE", help="save the results as a baseline")
+    parser.add_argument("--compare", metavar="FILE", help="compare the results with a baseline")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="how much slower than the baseline is fine (1.0: twice the time)")
+    args = parser.parse_args()
+
+    shaper, fa_module = import_addon()
+    calibration = calibrate()
+    results = {}
+    bench_shaping(shaper, results)
+    bench_editor(fa_module, shaper, results)
+
+    baseline = None
+    speed = 1.0
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            data = json.load(file)
+        baseline = data["results"]
+        speed = calibration / data["calibration"]
+
+    print_results(results, baseline, speed)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as file:
+            data = {"python": platform.python_version(), "machine": platform.machine(), "calibration": calibration, "results": results}
+            json.dump(data, file, indent=1)
+
+    if baseline is not None:
+        print(f"This machine is {speed:.2f}x the time of the baseline's", file=sys.stderr)
+        regressions = find_regressions(results, baseline, args.tolerance, speed)
+        for regression in regressions:
+            print("Slower:", regression, file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# A stand-in for the bpy module, to run FarsiText outside Blender.
+#
+# bpy.ops.font is an edit-mode text: it applies the operators FarsiText uses (so the cursor and
+# the selection behave like in Blender's text edit mode) and counts every call.
+
+import sys
+import types
+from collections import Counter
+
+
+class FontOperators:
+
+    def __init__(self):
+        self.text = ''
+        self.position = 0
+        self.anchor = None  # Other end of the selection
+        self.calls = Counter()
+
+    def reset(self, text=''):
+        self.text = text
+        self.position = len(text)
+        self.anchor = None
+        self.calls.clear()
+
+    def count(self):
+        return sum(self.calls.values())
+
+    def get_line_bounds(self, position):
+        start = self.text.rfind('\n', 0, position) + 1
+        end = self.text.find('\n', position)
+        return start, len(self.text) if end == -1 else end
+
+    def get_selection(self):
+        if self.anchor is None or self.anchor == self.position:
+            return None
+        return min(self.anchor, self.position), max(self.anchor, self.position)
+
+    def delete_selection(self):
+        selection = self.get_selection()
+        self.anchor = None
+        if selection is None:
+            return False
+        start, end = selection
+        self.text = self.text[:start] + self.text[end:]
+        self.position = start
+        return True
+
+    def move_cursor(self, type):
+        position = self.position
+
+        if type == 'PREVIOUS_CHARACTER':
+            self.position = max(position - 1, 0)
+            return
+        if type == 'NEXT_CHARACTER':
+            self.position = min(position + 1, len(self.text))
+            return
+
+        start, end = self.get_line_bounds(position)
+        if type == 'LINE_BEGIN':
+            position = start
+        elif type == 'LINE_END':
+            position = end
+        elif type == 'PREVIOUS_LINE' and start > 0:
+            previous_start, previous_end = self.get_line_bounds(start - 1)
+            position = min(previous_start + position - start, previous_end)
+        elif type == 'NEXT_LINE' and end < len(self.text):
+            next_start, next_end = self.get_line_bounds(end + 1)
+            position = min(next_start + position - start, next_end)
+
+        self.position = position
+
+    # The operators
+
+    def move(self, type):
+        self.calls['move'] += 1
+        self.anchor = None
+        self.move_cursor(type)
+
+    def move_select(self, type):
+        self.calls['move_select'] += 1
+        if self.anchor is None:
+            self.anchor = self.position
+        self.move_cursor(type)
+
+    def select_all(self):
+        self.calls['select_all'] += 1
+        self.anchor = 0
+        self.position = len(self.text)
+
+    def delete(self, type='PREVIOUS_OR_SELECTION'):
+        self.calls['delete'] += 1
+        if type.endswith('_OR_SELECTION') and self.delete_selection():
+            return
+        self.anchor = None
+        if type.startswith('PREVIOUS') and self.position > 0:
+            self.text = self.text[:self.position - 1] + self.text[self.position:]
+            self.position -= 1
+        elif type.startswith('NEXT'):
+            self.text = self.text[:self.position] + self.text[self.position + 1:]
+
+    def text_insert(self, text=''):
+        self.calls['text_insert'] += 1
+        if text:
+            self.delete_selection()
+        self.text = self.text[:self.position] + text + self.text[self.position:]
+        self.position += len(text)
+
+
+font = FontOperators()
+
+
+def install():
+    bpy = types.ModuleType('bpy')
+    bpy.ops = types.SimpleNamespace(font=font)
+    sys.modules['bpy'] = bpy
+    return bpy
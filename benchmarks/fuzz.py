@@ -0,0 +1,170 @@
+# Compare a shaping engine with the reference (the first version's functions, see reference.py)
+# on random texts of Farsi/Arabic letters, Lem-Alef, Latin words, digits, punctuation, spaces
+# and newlines.
+#
+#   python benchmarks/fuzz.py                                 the add-on's FarsiShaper
+#   python benchmarks/fuzz.py --module path/to/engine.py      another engine
+#   python benchmarks/fuzz.py --count 20000 --seed 7
+#
+# The engine needs link_text, swap_lines and unlink_text, its shape_text and
+# shape_text_vectorized (with NumPy) are checked too. Every text is also sent back and forth
+# (unlink ∘ swap ∘ link, what editing a shaped text does) and has to come back as the
+# reference's does. A text that gives another result is shrunk to a smallest one that still
+# does, and the exit code is 1. The time of each function is compared with the reference's.
+
+import argparse
+import importlib
+import importlib.util
+import os
+import random
+import sys
+import time
+
+import reference
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+farsi_letters = [c for c in reference.farsi_chars if c not in 'ةكيأإؤئ']
+arabic_letters = list('ةكيأإؤئ')
+latin_words = ['Blender', 'text', 'a', 'OK', 'v2', 'e-mail', 'x']
+digits = reference.chars_digits + list('۰۱۲۳۴۵۶۷۸۹')
+punctuation = reference.chars_farsi_symbols + reference.chars_common[1:] + ['?', '@', '#', '«', '»']
+
+# (weight, piece of text)
+pieces = [
+    (30, lambda generator: generator.choice(farsi_letters)),
+    (6, lambda generator: generator.choice(arabic_letters)),
+    (4, lambda generator: 'ل' + generator.choice('اأإآ')),
+    (5, lambda generator: generator.choice(latin_words)),
+    (5, lambda generator: ''.join(generator.choice(digits) for _ in range(generator.randint(1, 4)))),
+    (6, lambda generator: generator.choice(punctuation)),
+    (12, lambda generator: ' '),
+    (2, lambda generator: '\n'),
+]
+weights = [weight for weight, piece in pieces]
+
+
+def random_text(generator, max_length):
+    length = generator.randint(0, max_length)
+    text = []
+    while len(text) < length:
+        text.extend(generator.choices(pieces, weights)[0][1](generator))
+    return ''.join(text)
+
+
+def load_engine(name):
+    if name.endswith('.py'):
+        spec = importlib.util.spec_from_file_location(os.path.basename(name)[:-3], name)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    sys.path.insert(0, root)
+    return importlib.import_module(name)
+
+
+# The checks: name -> (engine's function, reference's function, what they are given for a text)
+# swap_lines and unlink_text are given the reference's linked text, so only they are timed.
+def get_checks(engine):
+    checks = {
+        "link_text": (engine.link_text, reference.link_text, str),
+        "swap_lines": (engine.swap_lines, reference.swap_lines, reference.link_text),
+        "unlink_text": (lambda linked: ''.join(engine.unlink_text(linked)),
+                        lambda linked: ''.join(reference.unlink_text(linked)), reference.link_text),
+        "round_trip": (lambda text: ''.join(engine.unlink_text(engine.swap_lines(engine.swap_lines(engine.link_text(text))))),
+                       lambda text: ''.join(reference.unlink_text(reference.swap_lines(reference.swap_lines(reference.link_text(text))))),
+                       str),
+    }
+
+    reference_shape_text = lambda text: reference.swap_lines(reference.link_text(text))
+    if hasattr(engine, "shape_text"):
+        def shape_text(text):
+            if hasattr(engine, "line_cache"):
+                engine.line_cache.clear()
+            return engine.shape_text(text)
+        checks["shape_text"] = (shape_text, reference_shape_text, str)
+    if hasattr(engine, "shape_text_vectorized") and engine.load_numpy():
+        checks["shape_text_vectorized"] = (engine.shape_text_vectorized, reference_shape_text, str)
+
+    return checks
+
+
+# A smallest text (removing pieces of it) that still gives another result than the reference's
+def shrink(text, function, reference_function, prepare):
+    def fails(text):
+        try:
+            given = prepare(text)
+            return function(given) != reference_function(given)
+        except Exception:
+            return True
+
+    size = max(len(text) // 2, 1)
+    while size >= 1:
+        start = 0
+        while start < len(text):
+            shorter = text[:start] + text[start + size:]
+            if fails(shorter):
+                text = shorter
+            else:
+                start += size
+        size //= 2
+    return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare a Farsi shaping engine with the reference")
+    parser.add_argument("--module", default="FarsiShaper", help="the engine: a module name or a .py file")
+    parser.add_argument("--count", type=int, default=5000, help="random texts")
+    parser.add_argument("--max-length", type=int, default=200, help="chars per text at most")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--show", type=int, default=5, help="mismatches to show per function")
+    args = parser.parse_args()
+
+    engine = load_engine(args.module)
+    checks = get_checks(engine)
+    generator = random.Random(args.seed)
+    texts = [random_text(generator, args.max_length) for _ in range(args.count)]
+
+    failed = False
+    print(f"{'function':24} {'mismatches':>10} {'engine':>10} {'reference':>10} {'speedup':>8}")
+    for name, (function, reference_function, prepare) in checks.items():
+        mismatches = []
+        engine_time = reference_time = 0.0
+        for text in texts:
+            given = prepare(text)
+            start = time.perf_counter()
+            expected = reference_function(given)
+            reference_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            try:
+                result = function(given)
+            except Exception as error:
+                result = error
+            engine_time += time.perf_counter() - start
+
+            if result != expected:
+                mismatches.append(text)
+
+        print(f"{name:24} {len(mismatches):>10} {engine_time:>9.3f}s {reference_time:>9.3f}s {reference_time / max(engine_time, 1e-9):>7.1f}x")
+
+        shown = set()
+        for text in mismatches:
+            if len(shown) == args.show:
+                break
+            text = shrink(text, function, reference_function, prepare)
+            if text in shown:
+                continue
+            shown.add(text)
+            given = prepare(text)
+            try:
+                result = function(given)
+            except Exception as error:
+                result = error
+            print(f"  {name}({given!r}): {result!r}, the reference gives {reference_function(given)!r}", file=sys.stderr)
+        failed = failed or bool(mismatches)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())